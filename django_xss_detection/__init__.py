@@ -1 +1,2 @@
 __version__ = "0.4.17"
+default_app_config = 'django_xss_detection.apps.XSSDetectionConfig'
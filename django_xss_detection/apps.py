@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class XSSDetectionConfig(AppConfig):
+    name = 'django_xss_detection'
+    verbose_name = "django xss detection"
+
+    def ready(self):
+        if getattr(settings, 'XSS_DETECTION_CHECK', False):
+            from django.core import checks
+            from .checks import check_templates
+            checks.register('security')(check_templates)
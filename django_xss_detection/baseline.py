@@ -0,0 +1,95 @@
+""" fingerprinting findings so that a scan can be compared against
+    a baseline of already accepted findings.
+
+    A fingerprint does not include the line number of a finding, so
+    findings are still recognised after unrelated lines have been added
+    to or removed from a template. Instead, findings with the same
+    template, reason, text and enclosing block or tag are told apart by
+    their occurrence, see get_result_fingerprints.
+"""
+import hashlib
+import io
+import re
+
+from django.utils import six
+
+WHITESPACE_RE = re.compile(r"\s+", re.UNICODE)
+
+
+def normalize_vulnerability_text(text):
+    """ returns the vulnerability text without any whitespace, e.g.
+        '{{ foo | safe }}' and '{{foo|safe}}' are normalized to the same text.
+    """
+    return WHITESPACE_RE.sub('', text or '')
+
+
+def get_fingerprint(template_name, result, occurrence=0):
+    """ returns a stable fingerprint (hex digest) for a finding of the
+        given template. occurrence is the number of findings before it,
+        in the same template, that have the same fingerprint otherwise.
+    """
+    parts = [
+        template_name,
+        result._get_reason(),
+        normalize_vulnerability_text(result.get_vulnerability_text()),
+        result.get_enclosing_name() or '',
+    ]
+    if occurrence:
+        parts.append(occurrence)
+    key = u'\0'.join(six.text_type(part) for part in parts)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def get_result_fingerprints(template_name, results):
+    """ returns a generator of (result, fingerprint) tuples for the results
+        of the given template, where the nth finding with the same
+        template, reason, text and enclosing block or tag is fingerprinted
+        with occurrence n - so that a second identical finding is not
+        mistaken for an accepted one.
+    """
+    occurrences = {}
+    for result in results:
+        fingerprint = get_fingerprint(template_name, result)
+        occurrence = occurrences.get(fingerprint, 0)
+        occurrences[fingerprint] = occurrence + 1
+        if occurrence:
+            fingerprint = get_fingerprint(template_name, result, occurrence)
+        yield result, fingerprint
+
+
+def get_fingerprints(f_results):
+    """ returns the set of fingerprints of the given (uniquified) results.
+    """
+    return set(fingerprint
+               for template_name, results in f_results.items()
+               for result, fingerprint in get_result_fingerprints(
+                   template_name, results))
+
+
+def load_baseline(path):
+    """ returns the set of fingerprints stored in the baseline file. """
+    with io.open(path, encoding='ascii') as f:
+        return frozenset(line.strip() for line in f if line.strip())
+
+
+def write_baseline(path, f_results):
+    """ writes the fingerprints of the given results to the baseline file,
+        one fingerprint per line.
+    """
+    with io.open(path, 'w', encoding='ascii') as f:
+        for fingerprint in sorted(get_fingerprints(f_results)):
+            f.write(u'%s\n' % fingerprint)
+
+
+def remove_baseline_results(f_results, baseline):
+    """ returns the results without the findings that have a fingerprint
+        in the baseline.
+    """
+    ret = {}
+    for template_name, results in f_results.items():
+        new_results = [result for result, fingerprint in
+                       get_result_fingerprints(template_name, results)
+                       if fingerprint not in baseline]
+        if new_results:
+            ret[template_name] = new_results
+    return ret
@@ -0,0 +1,20 @@
+""" an optional django system check (django >= 1.7) that reports the
+    findings of scanning the project's templates as warnings.
+    it is registered when settings.XSS_DETECTION_CHECK is True, see apps.py.
+"""
+from django.core import checks
+
+from . import util
+
+
+def check_templates(app_configs=None, **kwargs):
+    """ returns a warning for each finding in the project's templates. """
+    return [
+        checks.Warning(
+            "%s line %s: %s" % (result.get_vulnerability_text(),
+                                result.get_line_number(),
+                                result._get_reason()),
+            hint=result.get_filename(), obj=template_name,
+            id='django_xss_detection.W001')
+        for template_name, results in sorted(util.scan_project().items())
+        for result in results]
@@ -3,7 +3,19 @@ import argparse
 import collections
 import json
 import logging
+import os
+import sys
 
+from . import baseline as _baseline
+from . import compact_json
+from . import db as _db
+from . import profiling
+from . import metrics as _metrics
+from . import parse_template
+from . import shard as _shard
+from . import snippet_cache as _snippet_cache
+from . import stats as _stats
+from . import timings as _timings
 from . import util
 
 
@@ -17,27 +29,306 @@ def setup_option():
     opt.add_argument(
         "-j", "--json", dest="json_output",
         action="store_true", help="Print results out as JSON.")
+    _add_json_format_option(opt)
+    opt.add_argument(
+        "--shard", dest="shard", type=_parse_shard, metavar="INDEX/COUNT",
+        help="Only scan the templates of shard INDEX (counting from 0) "
+        "out of COUNT shards and print out its results as JSON. "
+        "Use the 'merge' command to combine the results of all shards.")
+    _add_baseline_options(opt)
+    _add_db_option(opt)
+    opt.add_argument(
+        "--skip-rendered-includes", dest="skip_rendered_includes",
+        action="store_true", help="Do not render an include again, "
+        "e.g. in another branch of an {% if %} tag, once its findings "
+        "have been recorded.")
+    opt.add_argument(
+        "--no-prefilter", dest="prefilter", action="store_false",
+        help="Scan every template, including templates that the lexical "
+        "pre-filter finds cannot have any findings.")
+    opt.add_argument(
+        "--no-content-dedup", dest="dedup_content", action="store_false",
+        help="Scan every template, including templates with the same "
+        "content as a template that has already been scanned.")
+    opt.add_argument(
+        "-J", "--jobs", dest="jobs", type=int, metavar="N", default=1,
+        help="Scan the templates with N worker processes.")
+    opt.add_argument(
+        "--threads", dest="use_threads", action="store_true",
+        help="Use N threads, rather than processes, for --jobs.")
+    opt.add_argument(
+        "--timings", dest="timings", metavar="FILE",
+        help="Record the scan duration of each template in FILE. "
+        "The durations recorded by previous scans are used to scan "
+        "the most expensive templates first when using --jobs.")
+    opt.add_argument(
+        "--snippet-cache-size", dest="snippet_cache_size", type=int,
+        metavar="N", default=_snippet_cache.DEFAULT_MAXSIZE,
+        help="The number of compiled <script> and html tag snippets to "
+        "cache (defaults to %(default)s, 0 disables the cache).")
+    opt.add_argument(
+        "--stats", dest="stats", action="store_true",
+        help="Print out statistics of the scan to stderr.")
+    opt.add_argument(
+        "--metrics-file", dest="metrics_file", metavar="FILE",
+        help="Periodically write the progress of the scan to FILE, "
+        "e.g. for the prometheus node exporter textfile collector.")
+    opt.add_argument(
+        "--metrics-format", dest="metrics_format",
+        default=_metrics.PROMETHEUS, choices=_metrics.FORMATS,
+        help="The format of the --metrics-file (defaults to %(default)s).")
+    opt.add_argument(
+        "--metrics-interval", dest="metrics_interval", type=float,
+        metavar="SECONDS", default=10.0,
+        help="The minimum number of seconds between writes of the "
+        "--metrics-file (defaults to %(default)s).")
+    opt.add_argument(
+        "--profile-template", dest="profile_template", metavar="GLOB",
+        help="Profile the scan of the templates whose name matches GLOB "
+        "with cProfile and tracemalloc (if available).")
+    opt.add_argument(
+        "--profile-dir", dest="profile_dir", metavar="DIR", default=".",
+        help="The directory to write the profiles of --profile-template "
+        "to (defaults to the current directory).")
+    return opt
+
+
+def setup_merge_option():
+    opt = argparse.ArgumentParser(
+        prog="%s merge" % sys.argv[0],
+        description="Merge the JSON results of the shards of a scan.")
+    opt.add_argument(
+        "shard_files", metavar="SHARD_FILE", nargs="+",
+        help="A file containing the output of a --shard scan.")
+    opt.add_argument(
+        "-j", "--json", dest="json_output",
+        action="store_true", help="Print results out as JSON.")
+    _add_json_format_option(opt)
+    _add_baseline_options(opt)
+    _add_db_option(opt)
     return opt
 
 
-def main(template_dirs, json_output=False, **kwargs):
+def setup_query_option():
+    opt = argparse.ArgumentParser(
+        prog="%s query" % sys.argv[0],
+        description="Query the findings stored with --db.")
+    opt.add_argument("db", metavar="DB_FILE", help="The --db FILE.")
+    opt.add_argument(
+        "-j", "--json", dest="json_output",
+        action="store_true", help="Print results out as JSON.")
+    opt.add_argument(
+        "--scan", dest="scan_id", type=int, metavar="ID",
+        help="Query the findings of scan ID (defaults to the latest scan).")
+    opt.add_argument(
+        "--template", dest="template", metavar="GLOB",
+        help="Only findings of templates matching GLOB, e.g. 'emails/*'.")
+    opt.add_argument(
+        "--reason", dest="reason", metavar="TEXT",
+        help="Only findings whose reason contains TEXT.")
+    opt.add_argument(
+        "--text", dest="text", metavar="TEXT",
+        help="Only findings whose vulnerability text contains TEXT, "
+        "e.g. '|safe'.")
+    compare = opt.add_mutually_exclusive_group()
+    compare.add_argument(
+        "--new-since", dest="new_since", type=int, metavar="ID",
+        help="Only findings that are not part of scan ID.")
+    compare.add_argument(
+        "--grown-since", dest="grown_since", type=int, metavar="ID",
+        help="Print the templates that have more findings than "
+        "in scan ID instead.")
+    return opt
+
+
+def _add_baseline_options(opt):
+    opt.add_argument(
+        "--baseline", dest="baseline", metavar="FILE",
+        help="Only report findings whose fingerprint is not "
+        "in the baseline FILE.")
+    opt.add_argument(
+        "--write-baseline", dest="write_baseline", action="store_true",
+        help="Write the fingerprints of all findings to the --baseline "
+        "FILE instead of using it to suppress findings.")
+
+
+def _add_json_format_option(opt):
+    opt.add_argument(
+        "--json-format", dest="json_format", default="default",
+        choices=["default", compact_json.FORMAT],
+        help="The format of the JSON output. The compact format stores "
+        "each reason and filename once and implies -j.")
+
+
+def _add_db_option(opt):
+    opt.add_argument(
+        "--db", dest="db", metavar="FILE",
+        help="Also store the findings in the sqlite database FILE, "
+        "see the 'query' command.")
+
+
+def _check_baseline_options(opt, args):
+    if args.write_baseline and not args.baseline:
+        opt.error("--write-baseline requires --baseline FILE")
+
+
+def _parse_shard(value):
+    try:
+        return _shard.parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def main(template_dirs, json_output=False, shard=None, baseline=None,
+         write_baseline=False, db=None, **kwargs):
     util.configure_django(template_dirs)
     if 'logging_capture_warnings' in kwargs:
         logging.captureWarnings(kwargs.get('logging_capture_warnings'))
-    f_results = util.walk_templates(template_dirs)
+    if kwargs.get('snippet_cache_size') is not None:
+        parse_template.snippet_cache.resize(kwargs['snippet_cache_size'])
+    walk_kwargs = {
+        'skip_rendered_includes': kwargs.get('skip_rendered_includes', False),
+        'prefilter': kwargs.get('prefilter', True),
+        'dedup_content': kwargs.get('dedup_content', True),
+        'stats': _stats.ScanStats(),
+        'jobs': kwargs.get('jobs') or 1,
+        'use_threads': kwargs.get('use_threads', False),
+    }
+    if kwargs.get('metrics_file'):
+        walk_kwargs['metrics'] = _metrics.MetricsWriter(
+            kwargs['metrics_file'],
+            kwargs.get('metrics_format') or _metrics.PROMETHEUS,
+            kwargs.get('metrics_interval', 10.0))
+    timings_file = kwargs.get('timings')
+    if timings_file:
+        walk_kwargs['timings'] = _timings.load_timings(timings_file)
+    profile_hooks = []
+    if kwargs.get('profile_template'):
+        profile_hooks.append(profiling.TemplateProfiler(
+            kwargs['profile_template'], kwargs.get('profile_dir') or '.'))
+    if shard is not None:
+        results = util.walk_templates(template_dirs, shard=shard,
+                                      uniquify=False,
+                                      profile_hooks=profile_hooks,
+                                      **walk_kwargs)
+        print(json.dumps(_shard.dump_shard_results(results, *shard)))
+        _write_timings(timings_file, walk_kwargs)
+        _output_stats(walk_kwargs['stats'], kwargs.get('stats'))
+        return
+    fingerprints = None
+    if baseline and not write_baseline:
+        fingerprints = _baseline.load_baseline(baseline)
+    f_results = util.walk_templates(template_dirs,
+                                    profile_hooks=profile_hooks,
+                                    **walk_kwargs)
+    if write_baseline:
+        _baseline.write_baseline(baseline, f_results)
+    _write_timings(timings_file, walk_kwargs)
+    _store_results(db, f_results, template_dirs)
+    if fingerprints is not None:
+        f_results = _baseline.remove_baseline_results(f_results, fingerprints)
+    _output_results(f_results, json_output, kwargs.get('json_format'))
+    _output_stats(walk_kwargs['stats'], kwargs.get('stats'))
+
+
+def _write_timings(timings_file, walk_kwargs):
+    if timings_file:
+        _timings.write_timings(timings_file, walk_kwargs['timings'])
+
+
+def merge(shard_files, json_output=False, baseline=None,
+          write_baseline=False, db=None, json_format=None):
+    shard_outputs = []
+    for shard_file in shard_files:
+        with open(shard_file) as f:
+            shard_outputs.append(json.load(f))
+    f_results = util.uniquify_results(
+        _shard.load_shard_results(shard_outputs))
+    if write_baseline:
+        _baseline.write_baseline(baseline, f_results)
+    _store_results(db, f_results)
+    if baseline and not write_baseline:
+        f_results = _baseline.remove_baseline_results(
+            f_results, _baseline.load_baseline(baseline))
+    _output_results(f_results, json_output, json_format)
+
+
+def _store_results(db, f_results, template_dirs=None):
+    """ stores all findings, including the ones of the baseline, so that
+        scans can be compared regardless of the baseline.
+    """
+    if db:
+        conn = _db.connect(db)
+        try:
+            _db.store_results(conn, f_results, template_dirs)
+        finally:
+            conn.close()
+
+
+def query(db, json_output=False, scan_id=None, grown_since=None,
+          **kwargs):
+    conn = _db.connect(db)
+    try:
+        if scan_id is None:
+            scan_id = _db.get_latest_scan_id(conn)
+        if grown_since is not None:
+            rows = _db.get_grown_templates(conn, scan_id, grown_since)
+            if json_output:
+                print(json.dumps([dict(zip(
+                    ['template', 'previous_count', 'count'], row))
+                    for row in rows]))
+            else:
+                for row in rows:
+                    print('%s %s -> %s' % tuple(row))
+            return
+        rows = _db.query_findings(conn, scan_id, **kwargs)
+    finally:
+        conn.close()
     if json_output:
+        print(json.dumps([dict(zip(row.keys(), row)) for row in rows]))
+        return
+    template_name = None
+    for row in rows:
+        if row['template'] != template_name:
+            template_name = row['template']
+            print(template_name)
+        print('     %s %s %s' % (row['line_number'],
+                                 row['vulnerability_text'], row['filename']))
+
+
+def _output_results(f_results, json_output=False, json_format=None):
+    if json_format == compact_json.FORMAT:
+        compact_json.write_compact_json(f_results, sys.stdout)
+    elif json_output:
         _output_results_in_json(f_results)
     else:
-        for template_name, results in f_results.items():
-            print(template_name)
-            for result in results:
-                print('    ', result)
+        for line in _get_results_as_text(f_results):
+            print(line)
+
+
+def _get_results_as_text(f_results):
+    """ returns a generator of the lines of the text output of results. """
+    for template_name, results in f_results.items():
+        yield template_name
+        for result in results:
+            yield '     %s' % (result, )
+
+
+def _output_stats(scan_stats, output_stats=False):
+    if output_stats:
+        print(scan_stats.format(), file=sys.stderr)
 
 
 def _output_results_in_json(f_results):
     """ Prints out results in JSON in the following format:
         {'filename' : [{'result ...}, 'filename_two' : [...] }
     """
+    print(json.dumps(_get_results_for_json(f_results)))
+
+
+def _get_results_for_json(f_results):
+    """ returns the results in the format used by _output_results_in_json.
+    """
     out = collections.defaultdict(list)
     for filename, results in f_results.items():
         for result in results:
@@ -47,13 +338,51 @@ def _output_results_in_json(f_results):
                 'vulnerability_text': result.get_vulnerability_text(),
             }
             out[result.get_filename()].append(result_dict)
-    print(json.dumps(out))
+    return out
 
 
 def from_cli():
+    if sys.argv[1:2] == ['merge']:
+        opt = setup_merge_option()
+        args = opt.parse_args(sys.argv[2:])
+        _check_baseline_options(opt, args)
+        merge(args.shard_files, args.json_output, baseline=args.baseline,
+              write_baseline=args.write_baseline, db=args.db,
+              json_format=args.json_format)
+        return
+    if sys.argv[1:2] == ['query']:
+        opt = setup_query_option()
+        args = opt.parse_args(sys.argv[2:])
+        if not os.path.isfile(args.db):
+            opt.error("%s does not exist" % args.db)
+        query(args.db, args.json_output, scan_id=args.scan_id,
+              grown_since=args.grown_since, template=args.template,
+              reason=args.reason, text=args.text, new_since=args.new_since)
+        return
     opt = setup_option()
     args = opt.parse_args()
-    main(args.template_dirs, args.json_output, logging_capture_warnings=False)
+    _check_baseline_options(opt, args)
+    if args.jobs < 1:
+        opt.error("--jobs must be at least 1")
+    if args.shard is not None and args.baseline:
+        opt.error("--baseline is applied when merging the shards, "
+                  "not with --shard")
+    if args.shard is not None and args.db:
+        opt.error("--db is applied when merging the shards, "
+                  "not with --shard")
+    main(args.template_dirs, args.json_output, shard=args.shard,
+         baseline=args.baseline, write_baseline=args.write_baseline,
+         db=args.db, json_format=args.json_format,
+         profile_template=args.profile_template,
+         profile_dir=args.profile_dir,
+         skip_rendered_includes=args.skip_rendered_includes,
+         prefilter=args.prefilter, dedup_content=args.dedup_content,
+         stats=args.stats, jobs=args.jobs, use_threads=args.use_threads,
+         timings=args.timings,
+         metrics_file=args.metrics_file, metrics_format=args.metrics_format,
+         metrics_interval=args.metrics_interval,
+         snippet_cache_size=args.snippet_cache_size,
+         logging_capture_warnings=False)
 
 
 if __name__ == "__main__":
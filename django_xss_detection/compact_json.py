@@ -0,0 +1,51 @@
+""" a compact JSON format of results, for very large result sets.
+    reasons and filenames are stored once, in lookup tables, and each
+    finding is an array of
+    [filename index, finding_reason index, line_number, vulnerability_text].
+"""
+import json
+
+FORMAT = 'compact'
+
+
+def iter_compact_json(f_results):
+    """ returns a generator of the chunks of text of the results in the
+        compact JSON format, so that it can be written incrementally.
+        the lookup tables follow the findings.
+    """
+    filenames, reasons = {}, {}
+    yield '{"format": %s, "findings": [' % json.dumps(FORMAT)
+    separator = ''
+    for results in f_results.values():
+        for result in results:
+            filename = filenames.setdefault(
+                result.get_filename(), len(filenames))
+            reason = reasons.setdefault(result._get_reason(), len(reasons))
+            yield separator + json.dumps(
+                [filename, reason, result.get_line_number(),
+                 result.get_vulnerability_text()])
+            separator = ', '
+    yield '], "filenames": %s, "reasons": %s}\n' % (
+        json.dumps(sorted(filenames, key=filenames.get)),
+        json.dumps(sorted(reasons, key=reasons.get)))
+
+
+def write_compact_json(f_results, f):
+    for chunk in iter_compact_json(f_results):
+        f.write(chunk)
+
+
+def expand_compact_json(data):
+    """ returns the loaded compact JSON data in the default JSON output
+        format, see cli._output_results_in_json.
+    """
+    out = {}
+    filenames, reasons = data['filenames'], data['reasons']
+    for filename, reason, line_number, vulnerability_text in \
+            data['findings']:
+        out.setdefault(filenames[filename], []).append({
+            'line_number': line_number,
+            'finding_reason': reasons[reason],
+            'vulnerability_text': vulnerability_text,
+        })
+    return out
@@ -0,0 +1,145 @@
+""" storing the (uniquified) results of scans in a sqlite database, so that
+    findings can be queried and compared across scans.
+"""
+import datetime
+import json
+import sqlite3
+
+from . import baseline
+
+BATCH_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created TEXT NOT NULL,
+    template_dirs TEXT
+);
+CREATE TABLE IF NOT EXISTS findings (
+    id INTEGER PRIMARY KEY,
+    scan_id INTEGER NOT NULL REFERENCES scans (id),
+    template TEXT NOT NULL,
+    filename TEXT,
+    line_number INTEGER,
+    finding_reason TEXT,
+    vulnerability_text TEXT,
+    include_name TEXT,
+    source_node_line INTEGER,
+    fingerprint TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS findings_scan_template
+    ON findings (scan_id, template);
+CREATE INDEX IF NOT EXISTS findings_scan_reason
+    ON findings (scan_id, finding_reason);
+CREATE INDEX IF NOT EXISTS findings_fingerprint_scan
+    ON findings (fingerprint, scan_id);
+"""
+
+FINDING_COLUMNS = ('template', 'filename', 'line_number', 'finding_reason',
+                   'vulnerability_text', 'include_name', 'source_node_line',
+                   'fingerprint')
+
+
+def connect(filename):
+    """ returns a connection to the sqlite database filename, creating
+        its tables if they do not exist yet.
+    """
+    conn = sqlite3.connect(filename)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _get_finding_rows(results):
+    for template_name, template_results in results.items():
+        for result, fingerprint in baseline.get_result_fingerprints(
+                template_name, template_results):
+            yield (template_name, result.get_filename(),
+                   result.get_line_number(), result._get_reason(),
+                   result.get_vulnerability_text(),
+                   result.get_include_name(), result.get_source_node_line(),
+                   fingerprint)
+
+
+def store_results(conn, results, template_dirs=None,
+                  batch_size=BATCH_SIZE):
+    """ stores the results of a scan in a new scan and returns its id.
+        the findings are inserted in batches of batch_size within a
+        single transaction.
+    """
+    with conn:
+        scan_id = conn.execute(
+            "INSERT INTO scans (created, template_dirs) VALUES (?, ?)",
+            (datetime.datetime.utcnow().isoformat(),
+             json.dumps(list(template_dirs or [])))).lastrowid
+        insert = "INSERT INTO findings (scan_id, %s) VALUES (?, %s)" % (
+            ', '.join(FINDING_COLUMNS),
+            ', '.join('?' * len(FINDING_COLUMNS)))
+        batch = []
+        for row in _get_finding_rows(results):
+            batch.append((scan_id, ) + row)
+            if len(batch) >= batch_size:
+                conn.executemany(insert, batch)
+                batch = []
+        if batch:
+            conn.executemany(insert, batch)
+    return scan_id
+
+
+def get_latest_scan_id(conn, before=None):
+    """ returns the id of the latest scan (before the scan id before),
+        or None if there is no such scan.
+    """
+    if before is None:
+        row = conn.execute("SELECT MAX(id) FROM scans").fetchone()
+    else:
+        row = conn.execute("SELECT MAX(id) FROM scans WHERE id < ?",
+                           (before, )).fetchone()
+    return row[0]
+
+
+def query_findings(conn, scan_id, template=None, reason=None, text=None,
+                   new_since=None):
+    """ returns the findings of a scan.
+        template: only findings of templates matching this glob pattern.
+        reason, text: only findings whose reason or vulnerability text
+        contain the given string.
+        new_since: only findings whose fingerprint is not part of the
+        scan with this id.
+    """
+    query = ("SELECT %s FROM findings WHERE scan_id = ?"
+             % ', '.join(FINDING_COLUMNS))
+    params = [scan_id]
+    if template is not None:
+        query += " AND template GLOB ?"
+        params.append(template)
+    if reason is not None:
+        query += " AND instr(finding_reason, ?) > 0"
+        params.append(reason)
+    if text is not None:
+        query += " AND instr(vulnerability_text, ?) > 0"
+        params.append(text)
+    if new_since is not None:
+        query += (" AND NOT EXISTS (SELECT 1 FROM findings AS previous"
+                  " WHERE previous.fingerprint = findings.fingerprint"
+                  " AND previous.scan_id = ?)")
+        params.append(new_since)
+    query += " ORDER BY template, line_number"
+    return conn.execute(query, params).fetchall()
+
+
+def get_grown_templates(conn, scan_id, previous_scan_id):
+    """ returns (template, previous count, count) rows of the templates
+        that have more findings in the scan than in the previous scan.
+    """
+    return conn.execute(
+        "SELECT current.template, COALESCE(previous.count, 0),"
+        " current.count"
+        " FROM (SELECT template, COUNT(*) AS count FROM findings"
+        " WHERE scan_id = ? GROUP BY template) AS current"
+        " LEFT JOIN (SELECT template, COUNT(*) AS count FROM findings"
+        " WHERE scan_id = ? GROUP BY template) AS previous"
+        " ON previous.template = current.template"
+        " WHERE current.count > COALESCE(previous.count, 0)"
+        " ORDER BY current.template",
+        (scan_id, previous_scan_id)).fetchall()
@@ -0,0 +1,46 @@
+import json
+from optparse import make_option
+
+import django
+from django.core.management.base import BaseCommand
+
+from ... import baseline as _baseline
+from ... import cli
+from ... import util
+
+
+class Command(BaseCommand):
+    help = ("Find potential xss bugs in the templates of this project, "
+            "using the project's template loaders.")
+    # scanning templates does not depend on models, and running the
+    # system checks could scan all templates twice, see checks.py.
+    if django.VERSION >= (1, 7):
+        requires_system_checks = False
+    else:
+        requires_model_validation = False
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "-j", "--json", dest="json_output", action="store_true",
+            default=False, help="Print results out as JSON."),
+        make_option(
+            "--baseline", dest="baseline", metavar="FILE",
+            help="Only report findings whose fingerprint is not "
+            "in the baseline FILE."),
+        make_option(
+            "--no-prefilter", dest="prefilter", action="store_false",
+            default=True, help="Scan every template, including templates "
+            "that the lexical pre-filter finds cannot have any findings."),
+    )
+
+    def handle(self, *args, **options):
+        fingerprints = None
+        if options.get('baseline'):
+            fingerprints = _baseline.load_baseline(options['baseline'])
+        f_results = util.scan_project(
+            baseline=fingerprints, prefilter=options.get('prefilter', True))
+        if options.get('json_output'):
+            self.stdout.write(json.dumps(cli._get_results_for_json(
+                f_results)))
+        else:
+            for line in cli._get_results_as_text(f_results):
+                self.stdout.write(line)
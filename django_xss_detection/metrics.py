@@ -0,0 +1,138 @@
+""" periodically writing the progress of a scan to a local metrics file,
+    see MetricsWriter.
+"""
+import json
+import os
+import re
+import time
+
+from . import stats as _stats
+
+PROMETHEUS = 'prometheus'
+JSON = 'json'
+FORMATS = (PROMETHEUS, JSON)
+
+METRIC_PREFIX = 'django_xss_detection_'
+METRIC_NAME_RE = re.compile(r"[^a-zA-Z0-9]+")
+
+
+def get_rss():
+    """ returns the resident set size, in bytes, of this process or None
+        if it is not known (/proc is not available).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def get_metric_name(name):
+    """ returns the prometheus metric name for a stats counter name,
+        e.g. 'templates skipped (pre-filter)' ->
+        'django_xss_detection_templates_skipped_pre_filter'.
+    """
+    return METRIC_PREFIX + METRIC_NAME_RE.sub('_', name).strip('_').lower()
+
+
+def _escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _replace(src, dst):
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:  # python 2, where os.rename replaces dst on posix
+        os.rename(src, dst)
+
+
+class MetricsWriter(object):
+    """ writes a snapshot of the stats.ScanStats of a scan to filename, as
+        a prometheus textfile or as JSON, at most once per interval seconds.
+        the file is replaced atomically so that it can be read at any time.
+        rss_bytes is the resident set size of this process, worker_rss_bytes
+        the last known one of each worker process of a parallel scan and
+        total_rss_bytes their sum.
+    """
+
+    def __init__(self, filename, metrics_format=PROMETHEUS, interval=10.0):
+        if metrics_format not in FORMATS:
+            raise ValueError("unknown metrics format %r" % (
+                metrics_format, ))
+        self.filename = filename
+        self.metrics_format = metrics_format
+        self.interval = interval
+        self.started = time.time()
+        self._last_write = None
+
+    def update(self, stats, force=False):
+        """ writes a snapshot of stats, unless one has been written less
+            than interval seconds ago and force is False.
+        """
+        now = time.time()
+        if (not force and self._last_write is not None and
+                now - self._last_write < self.interval):
+            return
+        self._last_write = now
+        self.write(self.get_snapshot(stats, now))
+
+    def get_snapshot(self, stats, now=None):
+        """ returns a dict of the metrics of stats. """
+        if now is None:
+            now = time.time()
+        elapsed = now - self.started
+        scanned = stats.get(_stats.TEMPLATES_SCANNED)
+        rss = get_rss()
+        total_rss = None
+        if rss is not None:
+            total_rss = rss + sum(stats.worker_rss.values())
+        return {
+            'counters': dict(stats.counts),
+            'findings': dict(stats.findings),
+            'elapsed_seconds': elapsed,
+            'templates_per_second': scanned / elapsed if elapsed else 0.0,
+            'rss_bytes': rss,
+            'worker_rss_bytes': dict(
+                (str(pid), worker_rss)
+                for pid, worker_rss in stats.worker_rss.items()),
+            'total_rss_bytes': total_rss,
+            'timestamp': now,
+        }
+
+    def write(self, snapshot):
+        if self.metrics_format == JSON:
+            content = json.dumps(snapshot, indent=1, sort_keys=True)
+        else:
+            content = self.format_prometheus(snapshot)
+        tmp_filename = '%s.%d.tmp' % (self.filename, os.getpid())
+        with open(tmp_filename, 'w') as f:
+            f.write(content)
+            f.write('\n')
+        _replace(tmp_filename, self.filename)
+
+    @staticmethod
+    def format_prometheus(snapshot):
+        """ returns the snapshot in the prometheus text format. """
+        metrics = [(get_metric_name(name), '', value)
+                   for name, value in sorted(snapshot['counters'].items())]
+        metrics.extend(
+            (get_metric_name('findings'),
+             '{reason="%s"}' % _escape_label_value(reason), count)
+            for reason, count in sorted(snapshot['findings'].items()))
+        metrics.extend(
+            (get_metric_name('worker_rss_bytes'), '{pid="%s"}' % pid, rss)
+            for pid, rss in sorted(snapshot['worker_rss_bytes'].items()))
+        metrics.extend(
+            (get_metric_name(name), '', snapshot[name])
+            for name in ['elapsed_seconds', 'templates_per_second',
+                         'rss_bytes', 'total_rss_bytes', 'timestamp']
+            if snapshot[name] is not None)
+        lines = []
+        for metric_name, labels, value in metrics:
+            type_line = '# TYPE %s gauge' % metric_name
+            if type_line not in lines:
+                lines.append(type_line)
+            lines.append('%s%s %s' % (metric_name, labels, value))
+        return '\n'.join(lines)
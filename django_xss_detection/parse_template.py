@@ -1,12 +1,26 @@
-import copy
+import contextlib
+import re
+import sys
+import threading
 
 import django
 import lxml.etree
 import lxml.html
+from django.conf import settings
 from django.template.base import Context
 from django.template import debug
 from django.utils import six
 
+from . import snippet_cache as _snippet_cache
+
+
+TEMPLATE_REFERENCE_RE = re.compile(
+    r"""{%\s*(?:extends|include)\s+(?P<quote>['"])(?P<name>.+?)(?P=quote)""")
+HTML_TAG_NAME_RE = re.compile(r"<\s*/?\s*(?P<name>[\w:-]+)")
+WAFFLE_TEMPLATETAGS = 'django_xss_detection.templatetags.waffle'
+_INCLUDE_NODE_CLASS = getattr(django.template.loader_tags, 'BaseIncludeNode',
+                              django.template.loader_tags.IncludeNode)
+
 
 def node_has_a_filter(node, filter_func_name):
     """ returns True if the node has the given filter_func_name
@@ -27,6 +41,7 @@ class InceptionDictionary(dict):
         django template variable and their attribute look ups always
         can always be 'resolved'.
     """
+    __slots__ = ()
 
     def __str__(self):
         if '__self__' in self:
@@ -46,6 +61,71 @@ class InceptionDictionary(dict):
         return self.__iter__()
 
 
+class InceptionPlaceholder(InceptionDictionary):
+    """ an InceptionDictionary that stands in for a missing variable.
+        placeholders are interned per scan and variable path (see
+        get_placeholder) and a missing key resolves to the placeholder of
+        the longer path, so placeholders are never modified and can be
+        shared by every context that is rendered.
+    """
+    __slots__ = ('path', )
+
+    def __missing__(self, key):
+        return get_placeholder(self.path + (key, ))
+
+
+def get_placeholder(path):
+    """ returns the InceptionPlaceholder for the given variable path,
+        e.g. ('user', 'name') for {{ user.name }}.
+        placeholders are interned per scan, in the placeholders of the
+        active CompileStringWrapper of the current thread, so that the
+        intern table is released with the scan.
+    """
+    csw = get_active_wrapper()
+    _placeholders = csw.placeholders if csw is not None else {}
+    placeholder = _placeholders.get(path)
+    if placeholder is None:
+        name = '.'.join(six.text_type(bit) for bit in path)
+        placeholder = InceptionPlaceholder({
+            '__self__': "<var var='%s' findme: %s />" % (
+                name, "injectedattributevalue='%s'" % name)})
+        placeholder.path = path
+        placeholder = _placeholders.setdefault(path, placeholder)
+    return placeholder
+
+
+def _get_enclosing_block_name(context):
+    """ returns a description of the {% block %} that is being rendered
+        in the given context, otherwise returns None.
+    """
+    block = context.get('block')
+    if isinstance(block, django.template.loader_tags.BlockNode):
+        return "{%% block %s %%}" % block.name
+    return None
+
+
+def _get_enclosing_tag_name(tag_content):
+    """ returns a description of the html element of the given tag
+        content, e.g. '<input' returns '<input>'. otherwise returns None.
+    """
+    match = HTML_TAG_NAME_RE.match(tag_content)
+    if match is None:
+        return None
+    return "<%s>" % match.group('name').lower()
+
+
+def _get_node_source_key(node):
+    """ returns a hashable key for the origin and source range
+        of the given node.
+    """
+    if node is None:
+        return None
+    source = getattr(node, 'source', None)
+    if not source:
+        return id(node)
+    return getattr(source[0], 'name', None), source[1]
+
+
 def _get_var_node_source_info(var_node):
     """ returns the line number, part and filename
         for a given variable node.
@@ -94,6 +174,42 @@ class IfEqualNodeOverload(django.template.defaulttags.IfEqualNode):
                 self.nodelist_false.render(context))
 
 
+class ForNodeOverload(django.template.defaulttags.ForNode):
+    """ this is used to replace the default
+        ForNode class - to render the loop body once, with placeholder
+        loop variables, and the {% empty %} nodelist.
+    """
+
+    def render(self, context):
+        parentloop = context['forloop'] if 'forloop' in context else {}
+        ret = []
+        context.push()
+        try:
+            try:
+                self.sequence.resolve(context, True)
+            except django.template.base.VariableDoesNotExist:
+                pass
+            context['forloop'] = {
+                'parentloop': parentloop, 'counter0': 0, 'counter': 1,
+                'revcounter': 1, 'revcounter0': 0,
+                'first': True, 'last': True}
+            for loopvar in self.loopvars:
+                context[loopvar] = get_placeholder((loopvar, ))
+            ret.append(self.nodelist_loop.render(context))
+            ret.append(self.nodelist_empty.render(context))
+        finally:
+            context.pop()
+        return '\n'.join(ret)
+
+
+_NODE_OVERLOADS = {
+    django.template.defaulttags.IfChangedNode: IfChangedNodeOverload,
+    django.template.defaulttags.IfNode: IfNodeOverload,
+    django.template.defaulttags.IfEqualNode: IfEqualNodeOverload,
+    django.template.defaulttags.ForNode: ForNodeOverload,
+}
+
+
 class VariableNodeAlertingOnUnescapeUse(debug.DebugVariableNode):
     def __init__(self, filter_expression, callback_func=None):
         super(VariableNodeAlertingOnUnescapeUse, self).__init__(
@@ -115,7 +231,8 @@ class VariableNodeAlertingOnUnescapeUse(debug.DebugVariableNode):
         if not escaped and msg and self.__callback_func:
             source_node = getattr(context, 'source_node', None)
             result = UnEscapedVariableFinding(
-                self, msg=msg, source_node=source_node)
+                self, msg=msg, source_node=source_node,
+                enclosing=_get_enclosing_block_name(context))
             self.__callback_func(result)
         try:
             return super(VariableNodeAlertingOnUnescapeUse, self).render(
@@ -135,26 +252,66 @@ class DebugNodeListOverLoad(debug.DebugNodeList):
     """
 
     def render_node(self, node, context):
-        source_node_name = 'source_node'
-        _include_node_name = 'IncludeNode'
-        _prev_include_node_name = 'BaseIncludeNode'
-        if hasattr(django.template.loader_tags,
-                   _prev_include_node_name):
-            _include_node_name = _prev_include_node_name
-        if isinstance(node, getattr(django.template.loader_tags,
-                                    _include_node_name)):
-            new_context = copy.copy(context)
-            if not hasattr(new_context, source_node_name):
-                setattr(new_context, source_node_name, node)
-            context = new_context
-        return super(DebugNodeListOverLoad, self).render_node(
-            node, context)
+        if not isinstance(node, _INCLUDE_NODE_CLASS):
+            return super(DebugNodeListOverLoad, self).render_node(
+                node, context)
+        source_node = getattr(context, 'source_node', None)
+        rendered_includes = getattr(context, 'rendered_includes', None)
+        if rendered_includes is not None:
+            """ the same include node, included from the same source node
+                and autoescape context, results in the same findings.
+            """
+            key = (_get_node_source_key(node),
+                   _get_node_source_key(source_node), context.autoescape)
+            if key in rendered_includes:
+                return ''
+            rendered_includes.add(key)
+        if source_node is not None:
+            return super(DebugNodeListOverLoad, self).render_node(
+                node, context)
+        # the source node is only set while the include node is rendered,
+        # so there is no need to copy the context.
+        context.source_node = node
+        try:
+            return super(DebugNodeListOverLoad, self).render_node(
+                node, context)
+        finally:
+            del context.source_node
+
+
+_scan_libraries = []
+
+
+def get_scan_libraries():
+    """ returns the tag libraries that are added to the scanning parser,
+        e.g. the waffle template tags.
+    """
+    if not _scan_libraries:
+        _scan_libraries.append(
+            django.template.base.import_library(WAFFLE_TEMPLATETAGS))
+    return _scan_libraries
 
 
 class ParserThatIdentifiesUnescapedVariable(debug.DebugParser):
+    def __init__(self, tokens):
+        super(ParserThatIdentifiesUnescapedVariable, self).__init__(tokens)
+        for library in get_scan_libraries():
+            self.add_library(library)
+
     def _set_var_callback_func(self, var_callback_func):
         self.var_callback_func = var_callback_func
 
+    def extend_nodelist(self, nodelist, node, token):
+        """ replaces the class of the nodes of the built in conditional
+            and loop tags, e.g. IfNode with IfNodeOverload, so that all of
+            their nodelists are rendered.
+        """
+        overload = _NODE_OVERLOADS.get(type(node))
+        if overload is not None:
+            node.__class__ = overload
+        super(ParserThatIdentifiesUnescapedVariable, self).extend_nodelist(
+            nodelist, node, token)
+
     def create_nodelist(self):
         return DebugNodeListOverLoad()
 
@@ -177,21 +334,14 @@ class ParserThatIdentifiesUnescapedVariable(debug.DebugParser):
 
 
 def _add_missing_to_context(var, context):
-    """ adds the variable and its lookup part to the context.
+    """ adds the variable to the context.
+        the lookup parts of the variable are resolved by its placeholder.
         returns the altered context.
     """
-    current = context
     if var.lookups is None:
         return context
-    for bit in var.lookups:
-        if bit in current and isinstance(current, InceptionDictionary):
-            current = current[bit]
-        else:
-            value = "<var var='%s' hash='%s' findme: %s />" % (
-                var, hash(var),
-                "injectedattributevalue='%s'" % var)
-            current[bit] = InceptionDictionary({'__self__': value})
-            current = current[bit]
+    bit = var.lookups[0]
+    context[bit] = get_placeholder((bit, ))
     return context
 
 
@@ -246,7 +396,7 @@ def compile_string(template_string, origin, callback=None):
     """
     lexer = debug.DebugLexer(template_string, origin)
     filtered_tokens = []
-    default_tags = set(debug.DebugParser([]).tags.keys())
+    default_tags = set(ParserThatIdentifiesUnescapedVariable([]).tags.keys())
     to_add = set()
     for tag in default_tags:
         to_add.add('end' + tag)
@@ -270,6 +420,23 @@ def compile_string(template_string, origin, callback=None):
     return parser.parse()
 
 
+snippet_cache = _snippet_cache.SnippetCache()
+
+
+def get_snippet_var_nodes(text):
+    """ returns the variable nodes of compiling the template snippet text.
+        the nodes are memoized by text in snippet_cache as the same snippets,
+        e.g. the same <script> block, repeat across templates.
+    """
+    nodes = snippet_cache.get(text)
+    if nodes is None:
+        origin = django.template.base.StringOrigin(text)
+        nodes = tuple(compile_string(text, origin).get_nodes_by_type(
+            debug.DebugVariableNode))
+        snippet_cache.put(text, nodes)
+    return nodes
+
+
 class UnEscapedFinding(object):
     """ this is the base class for representing an un-escaped finding """
 
@@ -286,9 +453,20 @@ class UnEscapedFinding(object):
         raise NotImplementedError("not implemented!")
 
     def __str__(self):
-        return "%s %s %s" % (self.get_line_number(),
-                             self.get_vulnerability_text(),
-                             self.get_filename())
+        location = "%s %s %s" % (self.get_line_number(),
+                                 self.get_vulnerability_text(),
+                                 self.get_filename())
+        description = self._get_description()
+        if description is None:
+            return location
+        return "%s \n\t\t%s" % (description, location)
+
+    def _get_description(self):
+        """ returns a description of the variable node and the reason
+            behind this finding, which __str__ prints before its location,
+            or None.
+        """
+        return None
 
     def _get_reason(self):
         """ returns a reason behind the finding
@@ -296,6 +474,39 @@ class UnEscapedFinding(object):
         """
         raise NotImplementedError("not implemented!")
 
+    def get_var_node_source_info(self):
+        """ returns the line number, part and filename of the variable
+            node behind this finding.
+        """
+        raise NotImplementedError("not implemented!")
+
+    def get_include_name(self):
+        """ returns the name of the included template that the variable
+            node of this finding was rendered from, otherwise returns None.
+        """
+        return None
+
+    def get_source_node_line(self):
+        """ returns the line number of the include node that the variable
+            node of this finding was rendered from, otherwise returns None.
+        """
+        return None
+
+    def get_enclosing_name(self):
+        """ returns a description of the block or html element that
+            encloses this finding, e.g. '{% block content %}' or
+            '<script>', otherwise returns None.
+        """
+        return getattr(self, '_enclosing', None)
+
+    def _get_emission_key(self):
+        """ returns a hashable key that is the same for findings that
+            are emitted more than once, e.g. because all branches of an
+            {% if %} tag render the same included template.
+            returns None if findings should never be de-duplicated.
+        """
+        return None
+
     def __unicode__(self):
         return six.text_type(self.__str__())
 
@@ -308,6 +519,7 @@ class UnEscapedVariableFinding(UnEscapedFinding):
         self._var_node = var_node
         self.source_node = kwargs.get('source_node', None)
         self.msg = kwargs.get('msg', '')
+        self._enclosing = kwargs.get('enclosing', None)
 
     def _get_var_node_source_info(self):
         part = self.get_vulnerability_text()
@@ -329,17 +541,32 @@ class UnEscapedVariableFinding(UnEscapedFinding):
     def get_filename(self):
         return self._get_var_node_source_info()[2]
 
+    def get_var_node_source_info(self):
+        return _get_var_node_source_info(self._var_node)
+
+    def get_include_name(self):
+        if not (self.source_node and self._var_node.source):
+            return None
+        return self._var_node.source[0].loadname
+
+    def get_source_node_line(self):
+        if not self.source_node:
+            return None
+        return _get_var_node_source_info(self.source_node)[0]
+
+    def _get_emission_key(self):
+        return (_get_node_source_key(self._var_node),
+                _get_node_source_key(self.source_node), self.msg)
+
     def _get_reason(self):
         return self.msg
 
-    def __str__(self):
-        super_str = super(UnEscapedVariableFinding, self).__str__()
+    def _get_description(self):
         s_node_info = None
         if self.source_node:
             s_node_info = _get_var_node_source_info(self.source_node)[:-1]
-        return "%s %s (source_node %s) \n\t\t%s" % (self._var_node,
-                                                    self.msg, s_node_info,
-                                                    super_str)
+        return "%s %s (source_node %s)" % (self._var_node, self.msg,
+                                           s_node_info)
 
 
 class BaseVariableContextFinding(UnEscapedFinding):
@@ -354,6 +581,7 @@ class BaseVariableContextFinding(UnEscapedFinding):
         self._filename = six.text_type(kwargs.get('filename'))
         self._vulnerability_text = six.text_type(
             kwargs.get('vulnerability_text'))
+        self._enclosing = kwargs.get('enclosing', None)
 
     def get_line_number(self):
         return self._line_number
@@ -364,10 +592,11 @@ class BaseVariableContextFinding(UnEscapedFinding):
     def get_filename(self):
         return self._filename
 
-    def __str__(self):
-        super_str = super(BaseVariableContextFinding, self).__str__()
-        return "%s %s \n\t\t%s" % (self._var_node, self._get_reason(),
-                                   super_str)
+    def get_var_node_source_info(self):
+        return _get_var_node_source_info(self._var_node)
+
+    def _get_description(self):
+        return "%s %s" % (self._var_node, self._get_reason())
 
 
 class UnEscapedVarJavascriptContextFinding(BaseVariableContextFinding):
@@ -388,18 +617,165 @@ class UnQuotedVarElementAttributeContext(BaseVariableContextFinding):
         return "In a html element attribute context without being quoted."
 
 
+class SerializedFinding(UnEscapedFinding):
+    """ this class represents a finding that has been loaded back from
+        its serialized form, see serialize_finding.
+    """
+
+    def __init__(self, **kwargs):
+        super(SerializedFinding, self).__init__(**kwargs)
+        self._line_number = kwargs.get('line_number')
+        self._reason = kwargs.get('finding_reason')
+        self._vulnerability_text = kwargs.get('vulnerability_text')
+        self._filename = kwargs.get('filename')
+        self._include_name = kwargs.get('include_name')
+        self._enclosing = kwargs.get('enclosing')
+        self._var_node_source_info = tuple(
+            kwargs.get('var_node_source_info') or (None, None, None))
+        self._description = kwargs.get('description')
+        self._source_node_line = kwargs.get('source_node_line')
+
+    def get_line_number(self):
+        return self._line_number
+
+    def get_vulnerability_text(self):
+        return self._vulnerability_text
+
+    def get_filename(self):
+        return self._filename
+
+    def get_var_node_source_info(self):
+        return self._var_node_source_info
+
+    def get_include_name(self):
+        return self._include_name
+
+    def get_source_node_line(self):
+        return self._source_node_line
+
+    def _get_reason(self):
+        return self._reason
+
+    def _get_description(self):
+        return self._description
+
+
+def serialize_finding(result):
+    """ returns a JSON serializable dict for the given finding, which can
+        be loaded back again with SerializedFinding(**result_dict).
+    """
+    return {
+        'line_number': result.get_line_number(),
+        'finding_reason': result._get_reason(),
+        'vulnerability_text': result.get_vulnerability_text(),
+        'filename': result.get_filename(),
+        'include_name': result.get_include_name(),
+        'source_node_line': result.get_source_node_line(),
+        'enclosing': result.get_enclosing_name(),
+        'var_node_source_info': list(result.get_var_node_source_info()),
+        'description': result._get_description(),
+    }
+
+
+def relocate_finding(result, filename, new_filename):
+    """ returns a SerializedFinding of the result, of the template file
+        filename, as if it was found in the template file new_filename
+        which has the same content.
+    """
+    result_dict = serialize_finding(result)
+    if result_dict['filename'] == filename:
+        result_dict['filename'] = new_filename
+    var_node_source_info = result_dict['var_node_source_info']
+    if var_node_source_info[2] == filename:
+        var_node_source_info[2] = new_filename
+    return SerializedFinding(**result_dict)
+
+
+def get_template_references(source):
+    """ returns the set of template names that are referenced by
+        {% extends %} and {% include %} tags with a literal name in source.
+    """
+    if not source:
+        return set()
+    return set(match.group('name')
+               for match in TEMPLATE_REFERENCE_RE.finditer(source))
+
+
+def _exit_managers(managers, exc_info):
+    """ exits the context managers in reverse order, as
+        contextlib.ExitStack does, and returns the exc_info of the
+        exception that is still raised (or (None, None, None)).
+    """
+    for manager in reversed(managers):
+        try:
+            if manager.__exit__(*exc_info):
+                exc_info = (None, None, None)
+        except BaseException:
+            exc_info = sys.exc_info()
+    return exc_info
+
+
 class CompileStringWrapper(object):
     """ a class that wraps calling compile_string so as to provide a
         'callback' func
     """
 
-    def __init__(self, callback_func=None, store_results=True):
+    def __init__(self, callback_func=None, store_results=True,
+                 profile_hooks=None):
         self.store_results = store_results
         self.callback_func = callback_func
+        self.profile_hooks = list(profile_hooks or [])
         self.results = []
+        self._emission_keys = set()
+        self.placeholders = {}
+
+    def add_profile_hook(self, profile_hook):
+        """ adds a profile hook, a callable that is called with a stage
+            ('scan', 'compile' or 'render') and a template name and returns
+            a context manager that is entered for the duration of that stage,
+            e.g. to run a profiler.
+            the name is the template name the template is loaded with,
+            relative to the template directories (e.g. 'tags/for.html'),
+            in every stage. a template compiled from a string, rather than
+            loaded, is compiled with the name None.
+        """
+        self.profile_hooks.append(profile_hook)
+
+    @contextlib.contextmanager
+    def profile(self, stage, name):
+        """ returns a context manager that runs the profile hooks around
+            the given stage of the template name.
+            like nested with statements (or contextlib.ExitStack), the hooks
+            that have been entered are exited in reverse order, also when
+            entering a later hook fails, and an exception is suppressed if
+            the __exit__ of a hook returns True. a hook cannot suppress
+            the failure of entering another hook.
+        """
+        managers = []
+        exc_info = (None, None, None)
+        entered = False
+        try:
+            for hook in self.profile_hooks:
+                manager = hook(stage, name)
+                manager.__enter__()
+                managers.append(manager)
+            entered = True
+            yield
+        except BaseException:
+            exc_info = sys.exc_info()
+        remaining_exc_info = _exit_managers(managers, exc_info)
+        if not entered:
+            six.reraise(*exc_info)
+        if remaining_exc_info[0] is not None:
+            six.reraise(*remaining_exc_info)
 
     def compile_string(self, template_string, origin):
-        return compile_string(template_string, origin, self.handle_callback)
+        if not self.profile_hooks:
+            return compile_string(
+                template_string, origin, self.handle_callback)
+        with self.profile('compile', getattr(origin, 'loadname', None)):
+            return compile_string(
+                template_string, origin, self.handle_callback)
 
     def handle_callback(self, result, **kwargs):
         if self.store_results:
@@ -408,16 +784,89 @@ class CompileStringWrapper(object):
             self.callback_func(result, **kwargs)
 
     def add_result(self, result):
+        key = result._get_emission_key()
+        if key is not None:
+            if key in self._emission_keys:
+                return
+            self._emission_keys.add(key)
         self.results.append(result)
 
 
+_active = threading.local()
+_compile_string_hook_lock = threading.Lock()
+_django_compile_string = django.template.base.compile_string
+
+
+def get_active_wrapper():
+    """ returns the CompileStringWrapper that compiles the templates
+        loaded by the current thread (see scanning) or None.
+    """
+    return getattr(_active, 'csw', None)
+
+
+def set_active_wrapper(csw):
+    """ sets the CompileStringWrapper of the current thread. """
+    install_compile_string_hook()
+    _active.csw = csw
+
+
+def _compile_string_hook(template_string, origin):
+    """ compiles with the active CompileStringWrapper of the current
+        thread or, without one, as django would.
+    """
+    csw = get_active_wrapper()
+    if csw is None:
+        return _django_compile_string(template_string, origin)
+    return csw.compile_string(template_string, origin)
+
+
+def install_compile_string_hook():
+    """ installs _compile_string_hook as django's compile_string. this
+        is only done once, as the hook dispatches to the CompileStringWrapper
+        of each thread, and does not change how templates are compiled
+        outside of a scan.
+    """
+    with _compile_string_hook_lock:
+        if django.template.base.compile_string is not _compile_string_hook:
+            django.template.base.compile_string = _compile_string_hook
+
+
+@contextlib.contextmanager
+def scanning(csw):
+    """ compiles the templates loaded by the current thread with the
+        CompileStringWrapper csw for the duration of the with block, so
+        that scans in different threads do not share any state.
+    """
+    previous = get_active_wrapper()
+    set_active_wrapper(csw)
+    try:
+        yield csw
+    finally:
+        _active.csw = previous
+
+
 def get_default_context():
     return Context({'csrf_token': 'csrf_token'})
 
 
+def get_template_source_loaders():
+    """ returns django's template source loaders, loading them in the same
+        way as django.template.loader.find_template if they have not been
+        loaded yet.
+    """
+    if django.template.loader.template_source_loaders is None:
+        loaders = []
+        for loader_name in settings.TEMPLATE_LOADERS:
+            loader = django.template.loader.find_template_loader(loader_name)
+            if loader is not None:
+                loaders.append(loader)
+        django.template.loader.template_source_loaders = tuple(loaders)
+    return django.template.loader.template_source_loaders
+
+
 def get_template_source(template_name):
     """ returns the source and 'origin' for a template name. """
-    for loader in django.template.loader.template_source_loaders:
+    for loader in get_template_source_loaders():
         try:
             source, origin = loader.load_template_source(
                 template_name)
@@ -450,9 +899,7 @@ def get_non_js_escaped_results_for_template(template, **kwargs):
         raise ValueError("could not parse source")
     for block in doc.xpath(".//script"):
         text = block.text_content()
-        origin = django.template.base.StringOrigin(text)
-        for node in compile_string(text, origin).get_nodes_by_type(
-                debug.DebugVariableNode):
+        for node in get_snippet_var_nodes(text):
             if node_has_a_filter(node, 'escapejs_filter'):
                 continue
             string_range = node.source[1]
@@ -461,7 +908,8 @@ def get_non_js_escaped_results_for_template(template, **kwargs):
             part = text[string_range[0]: string_range[1]]
             result = UnEscapedVarJavascriptContextFinding(
                 var_node=node, line_number=line_no,
-                filename=origin_fname, vulnerability_text=part)
+                filename=origin_fname, vulnerability_text=part,
+                enclosing="<script>")
             yield result
 
 
@@ -490,20 +938,17 @@ def get_non_quoted_attr_vars_for_template(template, **kwargs):
             current = content[_start: _end]
             content = content[_end + 1:]
             non_q_text = util.get_non_quoted_content(current)
-            origin = django.template.base.StringOrigin(non_q_text)
             if django.template.base.VARIABLE_TAG_START not in non_q_text:
                 continue
             try:
-                nodelist = compile_string(non_q_text, origin)
+                nodes = get_snippet_var_nodes(non_q_text)
             except django.template.base.TemplateSyntaxError:
-                nodelist = None
-            if not nodelist:
                 continue
-            for node in nodelist.get_nodes_by_type(
-                    debug.DebugVariableNode):
+            for node in nodes:
                 part = non_q_text[node.source[1][0]:node.source[1][1]]
                 res = UnQuotedVarElementAttributeContext(
                     var_node=node, line_number=line_no,
                     filename=origin_fname,
-                    vulnerability_text=part)
+                    vulnerability_text=part,
+                    enclosing=_get_enclosing_tag_name(current))
                 yield res
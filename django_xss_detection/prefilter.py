@@ -0,0 +1,32 @@
+""" a cheap lexical pre-filter that decides, from the raw source of a
+    template and of the templates it extends or includes, whether scanning
+    the template can result in any findings.
+"""
+import re
+
+SUSPICIOUS_SOURCE_RE = re.compile(
+    r"\|\s*safe\b"  # the safe filter
+    r"|{%\s*autoescape\s+off\s*%}"
+    r"|<\s*script"  # see get_non_js_escaped_results_for_template
+    # a variable that is not quoted inside a html tag,
+    # see get_non_quoted_attr_vars_for_template
+    r"""|<(?:[^<>"'\n]|"[^"\n]*"|'[^'\n]*')*{{""",
+    re.IGNORECASE)
+
+
+def is_source_suspicious(source):
+    """ returns True if the source contains anything that the detectors
+        can produce a finding for.
+    """
+    return bool(source) and SUSPICIOUS_SOURCE_RE.search(source) is not None
+
+
+def can_have_findings(template_index, template_name):
+    """ returns False if the template, and the templates that it
+        extends or includes, cannot result in any findings.
+        templates that are referenced by a variable, e.g.
+        {% include some_var %}, are not considered as they are loaded
+        as empty templates during a scan.
+    """
+    return any(template_index.get_info(name).suspicious
+               for name in template_index.get_closure(template_name))
@@ -0,0 +1,85 @@
+""" profiling the scan of individual templates, see TemplateProfiler. """
+import contextlib
+import cProfile
+import fnmatch
+import hashlib
+import io
+import os
+import re
+import warnings
+
+try:
+    import tracemalloc
+except ImportError:  # python < 3.4
+    tracemalloc = None
+
+UNSAFE_FILENAME_CHARS_RE = re.compile(r"[^\w.-]+", re.UNICODE)
+
+
+@contextlib.contextmanager
+def _not_profiled():
+    yield
+
+
+def get_profile_filename(template_name):
+    """ returns a file name (without an extension) for the profile
+        of the given template name, e.g. 'tags_for.html.0123abcd'.
+        the short hash of the template name keeps the file names of e.g.
+        'a/b.html' and 'a_b.html' apart.
+    """
+    digest = hashlib.sha1(template_name.encode('utf-8')).hexdigest()
+    return '%s.%s' % (
+        UNSAFE_FILENAME_CHARS_RE.sub('_', template_name).strip('_'),
+        digest[:8])
+
+
+class TemplateProfiler(object):
+    """ a CompileStringWrapper profile hook that profiles the scan of each
+        template matching a glob pattern.
+        a cProfile '.pstats' file and, where tracemalloc is available,
+        an '.allocations.txt' report of the top allocations are
+        written per template to profile_dir.
+    """
+
+    def __init__(self, pattern, profile_dir, top_allocations=25):
+        self.pattern = pattern
+        self.profile_dir = profile_dir
+        self.top_allocations = top_allocations
+        if tracemalloc is None:
+            warnings.warn("tracemalloc is not available, "
+                          "allocations will not be reported")
+
+    def __call__(self, stage, name):
+        if stage != 'scan' or not fnmatch.fnmatch(name, self.pattern):
+            return _not_profiled()
+        return self._profile(name)
+
+    @contextlib.contextmanager
+    def _profile(self, name):
+        if not os.path.isdir(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        path = os.path.join(self.profile_dir, get_profile_filename(name))
+        trace_allocations = (tracemalloc is not None and
+                             not tracemalloc.is_tracing())
+        if trace_allocations:
+            tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path + '.pstats')
+            if trace_allocations:
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                self._write_allocations(name, snapshot,
+                                        path + '.allocations.txt')
+
+    def _write_allocations(self, name, snapshot, path):
+        statistics = snapshot.statistics('lineno')
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(u"top %d allocations while scanning %s\n" % (
+                self.top_allocations, name))
+            for stat in statistics[:self.top_allocations]:
+                f.write(u"%s\n" % stat)
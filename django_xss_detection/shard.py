@@ -0,0 +1,85 @@
+""" splitting a scan across several machines (shards) and merging the
+    results of each shard back together.
+"""
+import warnings
+
+from . import parse_template
+from . import template_index as _template_index
+from . import timings as _timings
+
+
+def parse_shard(value):
+    """ parses an 'INDEX/COUNT' string, e.g. '0/4', and returns
+        an (index, count) tuple.
+    """
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise ValueError("%r is not of the form INDEX/COUNT" % value)
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("%r is not a valid shard, expecting "
+                         "0 <= INDEX < COUNT" % value)
+    return index, count
+
+
+def get_shard_templates(templates, index, count, template_index=None):
+    """ returns the templates, in their original order, that belong to
+        the given shard.
+        Each template is assigned on its own, as the results of the shards
+        are uniquified when they are merged, the most expensive template
+        first (see timings.estimate_cost) to the shard with the lowest
+        total cost so far.
+        The result only depends on the set of templates (and their sources)
+        so every machine scanning the same template directories agrees on
+        the partition.
+    """
+    if template_index is None:
+        template_index = _template_index.TemplateIndex()
+    templates = list(templates)
+    costs = sorted((-_timings.estimate_cost(template_index, templ), templ)
+                   for templ in set(templates))
+    loads = [0] * count
+    selected = set()
+    for cost, templ in costs:
+        shard_index = loads.index(min(loads))
+        loads[shard_index] -= cost
+        if shard_index == index:
+            selected.add(templ)
+    return [templ for templ in templates if templ in selected]
+
+
+def dump_shard_results(results, index, count):
+    """ returns a JSON serializable dict of the (not yet uniquified)
+        results of a shard.
+    """
+    return {
+        'shard': [index, count],
+        'results': dict(
+            (template_name, [parse_template.serialize_finding(result)
+                             for result in template_results])
+            for template_name, template_results in results.items()),
+    }
+
+
+def load_shard_results(shard_outputs):
+    """ returns the combined results of the given shard outputs
+        (as returned by dump_shard_results) - ready to be uniquified.
+    """
+    results = {}
+    seen, counts = set(), set()
+    for shard_output in shard_outputs:
+        index, count = shard_output['shard']
+        seen.add(index)
+        counts.add(count)
+        for template_name, template_results in \
+                shard_output['results'].items():
+            results.setdefault(template_name, []).extend(
+                parse_template.SerializedFinding(**result_dict)
+                for result_dict in template_results)
+    if len(counts) > 1:
+        warnings.warn("merging shards of different counts %s" % (
+            sorted(counts), ))
+    elif counts and seen != set(range(counts.pop())):
+        warnings.warn("merging an incomplete set of shards %s" % (
+            sorted(seen), ))
+    return results
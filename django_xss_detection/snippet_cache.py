@@ -0,0 +1,72 @@
+""" a bounded least recently used cache of the variable nodes of compiled
+    template snippets, e.g. the body of a <script> tag, see
+    parse_template.get_snippet_var_nodes.
+"""
+import collections
+import threading
+
+DEFAULT_MAXSIZE = 4096
+
+
+class SnippetCache(object):
+    """ maps snippet text to the variable nodes of the compiled snippet,
+        keeping at most maxsize snippets. a maxsize of 0 disables the cache.
+        hits and misses count the lookups of all threads, see
+        get_thread_counts for the lookups of the current thread.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._thread_counts = threading.local()
+
+    def get_thread_counts(self):
+        """ returns the (hits, misses) of the lookups of the current
+            thread.
+        """
+        return (getattr(self._thread_counts, 'hits', 0),
+                getattr(self._thread_counts, 'misses', 0))
+
+    def get(self, text):
+        """ returns the cached variable nodes of text or None. """
+        with self._lock:
+            nodes = self._items.pop(text, None)
+            hits, misses = self.get_thread_counts()
+            if nodes is None:
+                self.misses += 1
+                self._thread_counts.misses = misses + 1
+                return None
+            self.hits += 1
+            self._thread_counts.hits = hits + 1
+            self._items[text] = nodes
+            return nodes
+
+    def put(self, text, nodes):
+        with self._lock:
+            if self.maxsize <= 0:
+                return
+            self._items.pop(text, None)
+            self._items[text] = nodes
+            self._evict()
+
+    def resize(self, maxsize):
+        """ sets maxsize, evicting the least recently used snippets. """
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _evict(self):
+        while len(self._items) > max(self.maxsize, 0):
+            self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,72 @@
+""" statistics of a scan, see walk_templates. """
+import collections
+
+TEMPLATES_DISCOVERED = 'templates discovered'
+TEMPLATES_SCANNED = 'templates scanned'
+TEMPLATES_SKIPPED_PREFILTER = 'templates skipped (pre-filter)'
+TEMPLATES_SKIPPED_DUPLICATE = 'templates skipped (duplicate content)'
+# templates that could not be loaded, which are not counted as scanned
+TEMPLATES_SKIPPED_SYNTAX_ERROR = 'templates skipped (syntax error)'
+TEMPLATES_SKIPPED_DECODE_ERROR = 'templates skipped (decode error)'
+TEMPLATES_NOT_LOADED = (TEMPLATES_SKIPPED_SYNTAX_ERROR,
+                        TEMPLATES_SKIPPED_DECODE_ERROR)
+# scanned templates that could not be fully rendered
+TEMPLATES_RENDER_ERROR = 'templates with render errors'
+SNIPPET_CACHE_HITS = 'snippet cache hits'
+SNIPPET_CACHE_MISSES = 'snippet cache misses'
+SNIPPET_CACHE_HIT_RATE = 'snippet cache hit rate'
+
+
+class ScanStats(object):
+    """ named counters of a scan, e.g. the number of templates that have
+        been scanned, and the number of findings per reason. the findings
+        are counted as emitted, before uniquify_results, including the
+        ones copied to templates with duplicate content.
+    """
+
+    def __init__(self):
+        self.counts = collections.OrderedDict(
+            (name, 0) for name in [TEMPLATES_DISCOVERED, TEMPLATES_SCANNED,
+                                   TEMPLATES_SKIPPED_PREFILTER,
+                                   TEMPLATES_SKIPPED_DUPLICATE,
+                                   TEMPLATES_SKIPPED_SYNTAX_ERROR,
+                                   TEMPLATES_SKIPPED_DECODE_ERROR,
+                                   TEMPLATES_RENDER_ERROR])
+        self.findings = collections.OrderedDict()
+        self.worker_rss = collections.OrderedDict()
+
+    def increment(self, name, count=1):
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def set(self, name, value):
+        self.counts[name] = value
+
+    def get(self, name):
+        return self.counts.get(name, 0)
+
+    def add_findings(self, results):
+        """ counts the findings of a template per reason. """
+        for result in results:
+            reason = result._get_reason()
+            self.findings[reason] = self.findings.get(reason, 0) + 1
+
+    def set_worker_rss(self, pid, rss):
+        """ sets the last known resident set size of a worker process. """
+        if rss is not None:
+            self.worker_rss[pid] = rss
+
+    def set_snippet_cache_counts(self, hits, misses):
+        """ sets the snippet cache counters and hit rate. """
+        self.set(SNIPPET_CACHE_HITS, hits)
+        self.set(SNIPPET_CACHE_MISSES, misses)
+        lookups = hits + misses
+        self.set(SNIPPET_CACHE_HIT_RATE,
+                 round(float(hits) / lookups, 3) if lookups else 0.0)
+
+    def format(self):
+        """ returns the counters as text, one counter per line. """
+        lines = ["%s: %s" % (name, value)
+                 for name, value in self.counts.items()]
+        lines.extend("findings (%s): %s" % (reason, count)
+                     for reason, count in self.findings.items())
+        return '\n'.join(lines)
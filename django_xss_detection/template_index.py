@@ -0,0 +1,68 @@
+""" facts about the raw source of templates, see TemplateIndex. """
+import collections
+import hashlib
+
+from . import parse_template
+from . import prefilter
+
+TemplateInfo = collections.namedtuple(
+    'TemplateInfo',
+    ['origin_fname', 'digest', 'references', 'suspicious', 'size'])
+
+
+class TemplateIndex(object):
+    """ caches facts about the raw source of templates, e.g. the names of
+        the templates that it extends or includes, so an instance should
+        only be used for a single scan.
+    """
+
+    def __init__(self):
+        self._infos = {}
+
+    def get_info(self, template_name):
+        """ returns a TemplateInfo for the template name. """
+        info = self._infos.get(template_name)
+        if info is None:
+            try:
+                source, origin_fname = parse_template.get_template_source(
+                    template_name)
+            except UnicodeDecodeError:
+                """ leave it to the scan to report the template. """
+                info = TemplateInfo(None, None, frozenset(), True, 0)
+            else:
+                digest = None
+                if source:
+                    digest = hashlib.sha1(source.encode('utf-8')).hexdigest()
+                info = TemplateInfo(
+                    origin_fname, digest,
+                    frozenset(parse_template.get_template_references(source)),
+                    prefilter.is_source_suspicious(source),
+                    len(source or ''))
+            self._infos[template_name] = info
+        return info
+
+    def get_closure(self, template_name):
+        """ returns the set of names of the template and of the templates
+            that it (indirectly) extends or includes.
+        """
+        closure = set()
+        pending = [template_name]
+        while pending:
+            name = pending.pop()
+            if name not in closure:
+                closure.add(name)
+                pending.extend(self.get_info(name).references)
+        return closure
+
+    def get_content_key(self, template_name):
+        """ returns a key that is the same for templates that have the same
+            content and that extend or include the same templates (with the
+            same content). returns None if the content is not known.
+        """
+        digest = self.get_info(template_name).digest
+        if digest is None:
+            return None
+        references = sorted(
+            (name, self.get_info(name).digest)
+            for name in self.get_closure(template_name) - {template_name})
+        return digest, tuple(references)
@@ -1,13 +1,33 @@
 #!/usr/bin/python
+import contextlib
+import json
 import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+import warnings
 
 import django
 import lxml.html
 from django.template import loader
+from django.utils import six
 
-from . import util
+from . import baseline
+from . import cli
+from . import compact_json
+from . import db
+from . import metrics
 from . import parse_template
+from . import prefilter
+from . import profiling
+from . import shard
+from . import snippet_cache
+from . import stats
+from . import template_index
+from . import timings
+from . import util
 
 
 def _get_test_template_dir():
@@ -62,6 +82,21 @@ class TestXSSDetection(unittest.TestCase):
     def test_for_tag(self):
         return self._test_template_tag("for.html")
 
+    def test_nested_for_tag_renders_loop_body_once(self):
+        """ test that nested loops render each loop body once, no matter
+            how many placeholders a sequence has collected.
+        """
+        templ = django.template.Template(
+            "{% for a in items %}{% for b in a.children %}"
+            "{{ b.name|safe }}{% endfor %}{% empty %}{{ none|safe }}"
+            "{% endfor %}")
+        context = parse_template.get_default_context()
+        context['items'] = parse_template.get_placeholder(('items', ))
+        templ.render(context)
+        names = [str(result._var_node.filter_expression.var)
+                 for result in self.csw.results]
+        self.assertEqual(names, ['b.name', 'none'])
+
     def test_ifchanged_tag(self):
         return self._test_template_tag("ifchanged.html")
 
@@ -93,9 +128,7 @@ class TestXSSDetection(unittest.TestCase):
     def test_custom_waffle_tag(self):
         return self._test_template_tag("custom/waffle.html")
 
-    @unittest.expectedFailure
     def test_include_in_for_tag_tag(self):
-        """ include tag in for loop is not handled correctly """
         return self._test_template_tag("include/includer.2.html")
 
     def test_attr_injection_variable_detection(self):
@@ -131,6 +164,550 @@ class TestXSSDetection(unittest.TestCase):
         for fname, count in fname_and_counts:
             self.assertEqual(len(results[fname]), count)
 
+    def test_shard_templates(self):
+        """ test that shards partition the templates. """
+        templates = list(util.get_template_names([self.template_dir]))
+        shards = [shard.get_shard_templates(templates, index, 3)
+                  for index in range(3)]
+        self.assertEqual(sorted(sum(shards, [])), sorted(templates))
+
+    def test_shard_templates_with_a_shared_base(self):
+        """ test that templates extending the same base template are
+            balanced across the shards.
+        """
+        from django.test.utils import override_settings
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        with open(os.path.join(tmp_dir, 'base.html'), 'w') as f:
+            f.write('<html>{% block content %}{% endblock %}</html>')
+        for i in range(40):
+            with open(os.path.join(tmp_dir, 'page%d.html' % i), 'w') as f:
+                f.write('{% extends "base.html" %}'
+                        '{% block content %}{{ v|safe }}{% endblock %}')
+        templates = list(util.get_template_names([tmp_dir]))
+        with override_settings(TEMPLATE_DIRS=[tmp_dir]):
+            shards = [shard.get_shard_templates(templates, index, 4)
+                      for index in range(4)]
+        self.assertEqual(sorted(sum(shards, [])), sorted(templates))
+        sizes = [len(shard_templates) for shard_templates in shards]
+        self.assertTrue(max(sizes) - min(sizes) <= 1, sizes)
+
+    def test_merge_shard_results(self):
+        """ test that merging the results of all shards gives the same
+            results as a scan of all templates.
+        """
+        expected = cli._get_results_for_json(
+            util.walk_templates([self.template_dir]))
+        shard_outputs = []
+        for index in range(3):
+            results = util.walk_templates(
+                [self.template_dir], shard=(index, 3), uniquify=False)
+            shard_outputs.append(json.loads(json.dumps(
+                shard.dump_shard_results(results, index, 3))))
+        merged = util.uniquify_results(
+            shard.load_shard_results(shard_outputs))
+        self.assertEqual(cli._get_results_for_json(merged), expected)
+
+    def test_baseline(self):
+        """ test that findings in the baseline are suppressed. """
+        results = util.walk_templates([self.template_dir])
+        fingerprints = baseline.get_fingerprints(results)
+        self.assertFalse(util.walk_templates(
+            [self.template_dir], baseline=fingerprints))
+        child_name = 'tags/extends/child.html'
+        child_fingerprints = set(
+            baseline.get_fingerprint(child_name, result)
+            for result in results[child_name])
+        new_results = util.walk_templates(
+            [self.template_dir], baseline=fingerprints - child_fingerprints)
+        self.assertEqual(list(new_results.keys()), [child_name])
+        self.assertEqual(new_results[child_name][0].get_enclosing_name(),
+                         '{% block inner %}')
+
+    def test_baseline_reports_a_new_identical_finding(self):
+        """ test that a finding that is identical to an accepted finding,
+            e.g. a second {{ a|safe }} in the same block, is not suppressed.
+        """
+        results = util.walk_templates([self.template_dir])
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'baseline')
+        baseline.write_baseline(path, results)
+        child_name = 'tags/extends/child.html'
+        accepted = results[child_name][0]
+        results[child_name].append(parse_template.SerializedFinding(
+            **parse_template.serialize_finding(accepted)))
+        new_results = baseline.remove_baseline_results(
+            results, baseline.load_baseline(path))
+        self.assertEqual(list(new_results.keys()), [child_name])
+        self.assertEqual(len(new_results[child_name]), 1)
+        self.assertEqual(new_results[child_name][0].get_vulnerability_text(),
+                         accepted.get_vulnerability_text())
+
+    def test_profile_hooks(self):
+        """ test that profile hooks are run around compiling templates. """
+        stages = []
+
+        @contextlib.contextmanager
+        def profile_hook(stage, name):
+            stages.append((stage, name))
+            yield
+
+        self.csw.add_profile_hook(profile_hook)
+        loader.get_template("tags/for.html")
+        self.assertEqual(stages, [('compile', "tags/for.html")])
+
+    def test_profile_hooks_are_exited(self):
+        """ test that entered profile hooks are exited when entering a
+            later hook fails and that a hook can suppress an exception.
+        """
+        events = []
+
+        @contextlib.contextmanager
+        def recording_hook(stage, name):
+            events.append('enter')
+            try:
+                yield
+            finally:
+                events.append('exit')
+
+        @contextlib.contextmanager
+        def failing_hook(stage, name):
+            raise ValueError(stage)
+            yield
+
+        csw = parse_template.CompileStringWrapper(
+            profile_hooks=[recording_hook, failing_hook])
+        with self.assertRaises(ValueError):
+            with csw.profile('scan', 'a.html'):
+                events.append('body')
+        self.assertEqual(events, ['enter', 'exit'])
+
+        @contextlib.contextmanager
+        def suppressing_hook(stage, name):
+            try:
+                yield
+            except KeyError:
+                pass
+
+        csw = parse_template.CompileStringWrapper(
+            profile_hooks=[suppressing_hook, recording_hook])
+        with csw.profile('scan', 'a.html'):
+            raise KeyError('a.html')
+        self.assertEqual(events, ['enter', 'exit', 'enter', 'exit'])
+
+    def test_template_profiler(self):
+        """ test that profiles are written for matching templates. """
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            profiler = profiling.TemplateProfiler("tags/f*.html", profile_dir)
+            util.walk_templates([self.template_dir], profile_hooks=[profiler])
+        profiles = set(os.listdir(profile_dir))
+        self.assertTrue(
+            profiling.get_profile_filename("tags/for.html") + ".pstats"
+            in profiles)
+        self.assertFalse(
+            profiling.get_profile_filename("tags/if.html") + ".pstats"
+            in profiles)
+        self.assertTrue(
+            profiling.get_profile_filename("tags/for.html").startswith(
+                "tags_for.html."))
+        self.assertNotEqual(profiling.get_profile_filename("a/b.html"),
+                            profiling.get_profile_filename("a_b.html"))
+
+    def test_findings_are_emitted_once(self):
+        """ test that rendering the same variable node again does not
+            record the finding again.
+        """
+        templ = django.template.Template("{{ x|safe }}")
+        context = parse_template.get_default_context()
+        templ.render(context)
+        templ.render(context)
+        self.assertEqual(len(self.csw.results), 1)
+
+    def test_skip_rendered_includes(self):
+        templ = django.template.Template(
+            '{% include "tags/include/includee.1.html" %}')
+        context = parse_template.get_default_context()
+        context.rendered_includes = set()
+        self.assertTrue(templ.render(context).strip())
+        self.assertFalse(templ.render(context).strip())
+        self.assertEqual(
+            cli._get_results_for_json(
+                util.walk_templates([self.template_dir])),
+            cli._get_results_for_json(util.walk_templates(
+                [self.template_dir], skip_rendered_includes=True)))
+
+    def test_prefilter(self):
+        """ test that the pre-filter skips templates without changing
+            the results.
+        """
+        scan_stats = stats.ScanStats()
+        results = util.walk_templates([self.template_dir], stats=scan_stats)
+        self.assertTrue(scan_stats.get(stats.TEMPLATES_SKIPPED_PREFILTER))
+        self.assertEqual(
+            scan_stats.get(stats.TEMPLATES_DISCOVERED),
+            scan_stats.get(stats.TEMPLATES_SCANNED) +
+            scan_stats.get(stats.TEMPLATES_SKIPPED_PREFILTER) +
+            scan_stats.get(stats.TEMPLATES_SKIPPED_DUPLICATE) +
+            scan_stats.get(stats.TEMPLATES_SKIPPED_SYNTAX_ERROR) +
+            scan_stats.get(stats.TEMPLATES_SKIPPED_DECODE_ERROR))
+        self.assertEqual(
+            cli._get_results_for_json(results),
+            cli._get_results_for_json(util.walk_templates(
+                [self.template_dir], prefilter=False)))
+        index = template_index.TemplateIndex()
+        self.assertFalse(prefilter.can_have_findings(
+            index, "tags/include/includee.1.html"))
+        self.assertTrue(prefilter.can_have_findings(
+            index, "tags/include/includer.1.html"))
+        self.assertTrue(prefilter.can_have_findings(
+            index, "tags/include/missing.html"))
+
+    def test_dedup_content(self):
+        """ test that templates with the same content are scanned once
+            and that their results have the right filename.
+        """
+        scan_stats = stats.ScanStats()
+        results = util.walk_templates([self.template_dir], stats=scan_stats)
+        self.assertEqual(
+            scan_stats.get(stats.TEMPLATES_SKIPPED_DUPLICATE), 1)
+        self.assertEqual(
+            cli._get_results_for_json(results),
+            cli._get_results_for_json(util.walk_templates(
+                [self.template_dir], dedup_content=False)))
+        self.assertEqual(
+            sum(scan_stats.findings.values()),
+            sum(len(template_results) for template_results in
+                util.walk_templates([self.template_dir],
+                                    uniquify=False).values()))
+        for name in ["duplicates/first.html", "duplicates/second.html"]:
+            self.assertEqual(len(results[name]), 1)
+            self.assertEqual(results[name][0].get_filename(),
+                             os.path.join(self.template_dir, name))
+
+    def test_snippet_cache(self):
+        """ test that the snippet cache is hit when scanning again and
+            that it does not change the results.
+        """
+        parse_template.snippet_cache.clear()
+        results = util.walk_templates([self.template_dir])
+        scan_stats = stats.ScanStats()
+        self.assertEqual(
+            cli._get_results_for_json(results),
+            cli._get_results_for_json(util.walk_templates(
+                [self.template_dir], stats=scan_stats)))
+        self.assertFalse(scan_stats.get(stats.SNIPPET_CACHE_MISSES))
+        self.assertTrue(scan_stats.get(stats.SNIPPET_CACHE_HITS))
+        self.assertEqual(scan_stats.get(stats.SNIPPET_CACHE_HIT_RATE), 1.0)
+
+    def test_parallel_scan(self):
+        """ test that scanning with worker processes gives the same
+            results and records the scan duration of each template.
+        """
+        scan_timings = {}
+        scan_stats = stats.ScanStats()
+        results = util.walk_templates([self.template_dir], jobs=2,
+                                      timings=scan_timings,
+                                      stats=scan_stats)
+        self.assertEqual(
+            cli._get_results_for_json(results),
+            cli._get_results_for_json(
+                util.walk_templates([self.template_dir])))
+        self.assertEqual(
+            len(scan_timings),
+            scan_stats.get(stats.TEMPLATES_SCANNED) +
+            scan_stats.get(stats.TEMPLATES_SKIPPED_SYNTAX_ERROR) +
+            scan_stats.get(stats.TEMPLATES_SKIPPED_DECODE_ERROR))
+        self.assertTrue(
+            all(duration >= 0 for duration in scan_timings.values()))
+
+    def test_parallel_scan_text_output(self):
+        """ test that the text output of a parallel scan, whose findings
+            are serialized, is the same as the text output of a serial scan
+            - in the same order.
+        """
+        serial = list(cli._get_results_as_text(
+            util.walk_templates([self.template_dir])))
+        self.assertTrue(any("safe' template filter" in line
+                            for line in serial))
+        parallel = util.walk_templates([self.template_dir], jobs=2)
+        self.assertEqual(list(cli._get_results_as_text(parallel)), serial)
+        self.assertEqual(
+            list(compact_json.iter_compact_json(parallel)),
+            list(compact_json.iter_compact_json(
+                util.walk_templates([self.template_dir]))))
+
+    def test_order_longest_first(self):
+        index = template_index.TemplateIndex()
+        templates = ["tags/include/includer.1.html",
+                     "tags/include/includee.1.html", "basic_test.html"]
+        self.assertEqual(
+            timings.order_longest_first(templates, index, {}),
+            sorted(templates, key=lambda templ: (
+                -timings.estimate_cost(index, templ), templ)))
+        self.assertTrue(
+            timings.estimate_cost(index, "tags/include/includer.1.html") >
+            timings.estimate_cost(index, "tags/include/includee.1.html"))
+        recorded = {"tags/include/includer.1.html": 0.5,
+                    "tags/include/includee.1.html": 1.0}
+        self.assertEqual(
+            timings.order_longest_first(templates[:2], index, recorded),
+            ["tags/include/includee.1.html",
+             "tags/include/includer.1.html"])
+
+    def test_db(self):
+        """ test storing the results of scans and querying them. """
+        results = util.walk_templates([self.template_dir])
+        conn = db.connect(':memory:')
+        first = db.store_results(conn, dict(
+            (name, template_results)
+            for name, template_results in results.items()
+            if name != "basic_test.html"))
+        second = db.store_results(conn, results, batch_size=2)
+        self.assertEqual(db.get_latest_scan_id(conn), second)
+        self.assertEqual(db.get_latest_scan_id(conn, before=second), first)
+        count = len(results["basic_test.html"])
+        self.assertEqual(
+            len(db.query_findings(conn, second)),
+            sum(len(template_results)
+                for template_results in results.values()))
+        new = db.query_findings(conn, second, new_since=first)
+        self.assertEqual(len(new), count)
+        self.assertEqual(set(row['template'] for row in new),
+                         set(["basic_test.html"]))
+        self.assertEqual(
+            [tuple(row) for row in db.get_grown_templates(
+                conn, second, first)],
+            [("basic_test.html", 0, count)])
+        included = [row for row in db.query_findings(conn, second)
+                    if row['include_name'] is not None]
+        self.assertTrue(included)
+        for row in included:
+            self.assertEqual(row['source_node_line'], row['line_number'])
+        merged = shard.load_shard_results([json.loads(json.dumps(
+            shard.dump_shard_results(results, 0, 1)))])
+        merged_scan = db.store_results(conn, merged)
+        self.assertEqual(
+            [tuple(row) for row in db.query_findings(conn, merged_scan)],
+            [tuple(row) for row in db.query_findings(conn, second)])
+        for row in db.query_findings(conn, second, template="tags/*",
+                                     text="safe"):
+            self.assertTrue(row['template'].startswith("tags/"))
+            self.assertTrue("safe" in row['vulnerability_text'])
+
+    def test_db_stores_baselined_findings(self):
+        """ test that merge stores the findings of the baseline in the
+            database, while only reporting the new ones.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        results = util.walk_templates([self.template_dir])
+        shard_file = os.path.join(tmp_dir, 'shard.json')
+        with open(shard_file, 'w') as f:
+            json.dump(shard.dump_shard_results(results, 0, 1), f)
+        baseline_file = os.path.join(tmp_dir, 'baseline.txt')
+        baseline.write_baseline(baseline_file, dict(
+            (name, template_results)
+            for name, template_results in results.items()
+            if name != "basic_test.html"))
+        db_file = os.path.join(tmp_dir, 'findings.db')
+        stdout = six.StringIO()
+        old_stdout, cli.sys.stdout = cli.sys.stdout, stdout
+        try:
+            cli.merge([shard_file], json_output=True,
+                      baseline=baseline_file, db=db_file)
+        finally:
+            cli.sys.stdout = old_stdout
+        self.assertEqual(
+            list(json.loads(stdout.getvalue())),
+            [os.path.join(self.template_dir, "basic_test.html")])
+        conn = db.connect(db_file)
+        self.addCleanup(conn.close)
+        self.assertEqual(
+            len(db.query_findings(conn, db.get_latest_scan_id(conn))),
+            sum(len(template_results)
+                for template_results in results.values()))
+
+    def test_query_missing_db(self):
+        """ test that querying a database that does not exist is an error
+            and does not create the database.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        db_file = os.path.join(tmp_dir, 'findings.db')
+        old_argv, old_stderr = cli.sys.argv, cli.sys.stderr
+        cli.sys.argv = ['cli', 'query', db_file]
+        cli.sys.stderr = six.StringIO()
+        try:
+            self.assertRaises(SystemExit, cli.from_cli)
+            self.assertTrue("does not exist" in cli.sys.stderr.getvalue())
+        finally:
+            cli.sys.argv, cli.sys.stderr = old_argv, old_stderr
+        self.assertFalse(os.path.exists(db_file))
+
+    def test_compact_json(self):
+        """ test that the compact JSON output expands to the default
+            JSON output.
+        """
+        results = util.walk_templates([self.template_dir])
+        out = six.StringIO()
+        compact_json.write_compact_json(results, out)
+        data = json.loads(out.getvalue())
+        self.assertEqual(len(data['reasons']), len(set(data['reasons'])))
+        self.assertEqual(
+            compact_json.expand_compact_json(data),
+            json.loads(json.dumps(cli._get_results_for_json(results))))
+
+    def test_metrics(self):
+        """ test that the metrics of a serial and of a parallel scan are
+            written to the metrics file.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        for jobs, metrics_format in [(1, metrics.JSON),
+                                     (2, metrics.PROMETHEUS)]:
+            filename = os.path.join(tmp_dir, 'metrics.%s' % metrics_format)
+            scan_stats = stats.ScanStats()
+            writer = metrics.MetricsWriter(filename, metrics_format)
+            results = util.walk_templates([self.template_dir], jobs=jobs,
+                                          stats=scan_stats, metrics=writer)
+            for name in [stats.TEMPLATES_SKIPPED_SYNTAX_ERROR,
+                         stats.TEMPLATES_SKIPPED_DECODE_ERROR]:
+                self.assertEqual(scan_stats.get(name), 1)
+            self.assertTrue(sum(scan_stats.findings.values()) >=
+                            sum(len(r) for r in results.values()))
+            with open(filename) as f:
+                content = f.read()
+            if metrics_format == metrics.JSON:
+                snapshot = json.loads(content)
+                self.assertEqual(snapshot['counters'],
+                                 json.loads(json.dumps(scan_stats.counts)))
+                self.assertEqual(snapshot['findings'],
+                                 dict(scan_stats.findings))
+                self.assertEqual(snapshot['worker_rss_bytes'], {})
+            else:
+                self.assertTrue(
+                    "django_xss_detection_templates_scanned %s\n" %
+                    scan_stats.get(stats.TEMPLATES_SCANNED) in content)
+                self.assertTrue('django_xss_detection_findings{reason="'
+                                in content)
+                self.assertTrue(scan_stats.worker_rss)
+                for pid, rss in scan_stats.worker_rss.items():
+                    self.assertTrue(
+                        'django_xss_detection_worker_rss_bytes{pid="%s"} %s'
+                        % (pid, rss) in content)
+                self.assertTrue(
+                    'django_xss_detection_total_rss_bytes ' in content)
+        self.assertEqual(len(os.listdir(tmp_dir)), 2)
+
+    def test_snippet_cache_counts_of_threads(self):
+        """ test that a thread scan only counts its own snippet cache
+            lookups.
+        """
+        def get_lookups(**kwargs):
+            scan_stats = stats.ScanStats()
+            util.walk_templates([self.template_dir], stats=scan_stats,
+                                **kwargs)
+            return (scan_stats.get(stats.SNIPPET_CACHE_HITS) +
+                    scan_stats.get(stats.SNIPPET_CACHE_MISSES))
+
+        lookups = get_lookups()
+        self.assertTrue(lookups)
+        self.assertEqual(get_lookups(jobs=4, use_threads=True), lookups)
+
+    def test_patched(self):
+        """ test that patched only changes the CompileStringWrapper of the
+            current thread, and restores it, without changing django's
+            template tags.
+        """
+        if_node = django.template.defaulttags.IfNode
+        builtins = list(django.template.base.builtins)
+        csw = parse_template.CompileStringWrapper()
+        with util.patched(csw):
+            self.assertTrue(parse_template.get_active_wrapper() is csw)
+        self.assertTrue(parse_template.get_active_wrapper() is self.csw)
+        self.assertTrue(django.template.defaulttags.IfNode is if_node)
+        self.assertEqual(django.template.base.builtins, builtins)
+
+    def test_concurrent_scans(self):
+        """ test that scans in different threads, of the same templates,
+            do not share their results.
+        """
+        expected = cli._get_results_for_json(
+            util.walk_templates([self.template_dir]))
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            util.walk_templates([self.template_dir], jobs=3,
+                                use_threads=True))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), len(threads))
+        for thread_results in results:
+            self.assertEqual(cli._get_results_for_json(thread_results),
+                             expected)
+
+    def test_scan_project(self):
+        """ test scanning the templates of an already configured project
+            with the management command.
+        """
+        from .management.commands import xss_scan
+        loaders = parse_template.get_template_source_loaders()
+        expected = cli._get_results_for_json(
+            util.walk_templates([self.template_dir]))
+        out = six.StringIO()
+        xss_scan.Command().execute(json_output=True, stdout=out)
+        self.assertEqual(json.loads(out.getvalue()),
+                         json.loads(json.dumps(expected)))
+        self.assertTrue(
+            django.template.loader.template_source_loaders is loaders)
+
+    def test_concurrent_scan_project(self):
+        """ test that overlapping project scans in threads restore the
+            project's template loaders and settings.
+        """
+        from django.conf import settings
+        from django.test.utils import override_settings
+        loaders = parse_template.get_template_source_loaders()
+        started = threading.Event()
+
+        @contextlib.contextmanager
+        def slow_hook(stage, name):
+            started.set()
+            time.sleep(0.001)
+            yield
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            util.scan_project(profile_hooks=[slow_hook])))
+            for _ in range(3)]
+        with override_settings(TEMPLATE_DEBUG=False):
+            for thread in threads:
+                thread.start()
+                started.wait()
+            for thread in threads:
+                thread.join()
+            self.assertFalse(settings.TEMPLATE_DEBUG)
+        self.assertTrue(
+            django.template.loader.template_source_loaders is loaders)
+        self.assertEqual(len(results), len(threads))
+        for thread_results in results:
+            self.assertEqual(cli._get_results_for_json(thread_results),
+                             cli._get_results_for_json(results[0]))
+
+    @unittest.skipIf(django.VERSION < (1, 7),
+                     "system checks require django >= 1.7")
+    def test_check_templates(self):
+        from . import checks
+        warnings = checks.check_templates()
+        self.assertTrue(warnings)
+        self.assertEqual(set(warning.id for warning in warnings),
+                         set(['django_xss_detection.W001']))
+
     def _test_template(self, template_path):
         """ test that the detector finds the problems
             in a given template file.
@@ -168,6 +745,60 @@ class TestUtil(unittest.TestCase):
         for content in ["a'b'cdc", 'a"b"cdc', """a'b'" "cdc"""]:
             self.assertEqual(method(content), "acdc")
 
+    def test_fingerprint_ignores_line_number_and_whitespace(self):
+        kwargs = {'finding_reason': 'reason', 'enclosing': '<script>'}
+        first = parse_template.SerializedFinding(
+            line_number=1, vulnerability_text='{{ x|safe }}', **kwargs)
+        second = parse_template.SerializedFinding(
+            line_number=10, vulnerability_text='{{x | safe}}', **kwargs)
+        self.assertEqual(baseline.get_fingerprint('a.html', first),
+                         baseline.get_fingerprint('a.html', second))
+        self.assertNotEqual(baseline.get_fingerprint('a.html', first),
+                            baseline.get_fingerprint('b.html', first))
+
+    def test_placeholders_are_interned(self):
+        csw = parse_template.CompileStringWrapper()
+        with parse_template.scanning(csw):
+            placeholder = parse_template.get_placeholder(('user', ))
+            self.assertTrue(
+                placeholder is parse_template.get_placeholder(('user', )))
+            self.assertTrue(placeholder['name'] is
+                            parse_template.get_placeholder(('user', 'name')))
+            self.assertFalse('name' in placeholder)
+            self.assertEqual(len(list(placeholder)), 1)
+        self.assertEqual(set(csw.placeholders),
+                         set([('user', ), ('user', 'name')]))
+        with parse_template.scanning(parse_template.CompileStringWrapper()):
+            self.assertFalse(
+                placeholder is parse_template.get_placeholder(('user', )))
+
+    def test_is_source_suspicious(self):
+        method = prefilter.is_source_suspicious
+        for source in ["{{ a | safe }}", "{% autoescape off %}{{ a }}",
+                       "<SCRIPT>", '<a href={{ a }}>',
+                       '<a title="<b>" href={{ a }}>']:
+            self.assertTrue(method(source))
+        for source in ["", "{{ a }}", '<a href="{{ a }}">{{ b }}</a>']:
+            self.assertFalse(method(source))
+
+    def test_snippet_cache_evicts_least_recently_used(self):
+        cache = snippet_cache.SnippetCache(maxsize=2)
+        cache.put('a', ())
+        cache.put('b', ())
+        self.assertEqual(cache.get('a'), ())
+        cache.put('c', ())
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.resize(0)
+        self.assertEqual(len(cache), 0)
+        cache.put('a', ())
+        self.assertEqual(cache.get('a'), None)
+
+    def test_parse_shard(self):
+        self.assertEqual(shard.parse_shard("1/4"), (1, 4))
+        for value in ["4/4", "-1/4", "0/0", "1", "a/b"]:
+            self.assertRaises(ValueError, shard.parse_shard, value)
+
 
 if __name__ == "__main__":
     unittest.main()
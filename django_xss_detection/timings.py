@@ -0,0 +1,65 @@
+""" the scan duration of each template, recorded by previous scans, so that
+    a parallel scan can start with the most expensive templates.
+"""
+import json
+import os
+import warnings
+
+TEMPLATE_COST = 1024
+""" the estimated cost, in source characters, of loading a template. """
+
+
+def load_timings(filename):
+    """ returns a dict of template name to scan duration (in seconds)
+        read from filename, or an empty dict if it does not exist yet.
+    """
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        try:
+            timings = json.load(f)
+        except ValueError as e:
+            warnings.warn("ignoring the timings in %s %s" % (
+                filename, repr(e)))
+            return {}
+    return dict((name, float(duration))
+                for name, duration in timings.items())
+
+
+def write_timings(filename, timings):
+    with open(filename, 'w') as f:
+        json.dump(timings, f, indent=1, sort_keys=True)
+
+
+def estimate_cost(template_index, template_name):
+    """ returns the estimated cost of scanning a template that has no
+        recorded duration: the size of its source and of the sources of the
+        templates that it (indirectly) extends or includes.
+    """
+    return sum(template_index.get_info(name).size + TEMPLATE_COST
+               for name in template_index.get_closure(template_name))
+
+
+def order_longest_first(templates, template_index, timings):
+    """ returns the templates ordered by their recorded, or otherwise
+        estimated, scan duration - longest first.
+        the estimate_cost of a template without a recorded duration is
+        converted to seconds using the templates with a recorded duration.
+    """
+    templates = list(templates)
+    costs = dict((templ, estimate_cost(template_index, templ))
+                 for templ in templates if templ not in timings)
+    recorded = [templ for templ in templates if templ in timings]
+    recorded_cost = sum(estimate_cost(template_index, templ)
+                        for templ in recorded)
+    seconds_per_cost = 1.0
+    if recorded_cost:
+        seconds_per_cost = (
+            sum(timings[templ] for templ in recorded) / recorded_cost)
+
+    def get_duration(templ):
+        if templ in timings:
+            return timings[templ]
+        return costs[templ] * seconds_per_cost
+
+    return sorted(templates, key=lambda templ: (-get_duration(templ), templ))
@@ -1,12 +1,26 @@
+import collections
+import contextlib
 import django
+import functools
+import multiprocessing
+import multiprocessing.pool
 import os
+import threading
+import time
 import warnings
 
 from django.conf import settings
 from django.template import loader
 from django.utils.encoding import smart_text
 
+from . import baseline as _baseline
+from . import metrics as _metrics
 from . import parse_template
+from . import prefilter as _prefilter
+from . import shard as _shard
+from . import stats as _stats
+from . import template_index as _template_index
+from . import timings as _timings
 
 
 def configure_django(template_dirs):
@@ -26,14 +40,108 @@ def configure_django(template_dirs):
 
 
 def patch(csw):
-    django.template.base.compile_string = csw.compile_string
-    django.template.defaulttags.IfChangedNode = parse_template.\
-        IfChangedNodeOverload
-    django.template.defaulttags.IfNode = parse_template.IfNodeOverload
-    django.template.defaulttags.IfEqualNode = parse_template.\
-        IfEqualNodeOverload
-    django.template.base.add_to_builtins(
-        'django_xss_detection.templatetags.waffle')
+    """ compiles the templates loaded by the current thread with csw,
+        see parse_template.scanning.
+    """
+    parse_template.set_active_wrapper(csw)
+
+
+def patched(csw):
+    """ compiles the templates loaded by the current thread with csw for
+        the duration of the with block, see parse_template.scanning.
+    """
+    return parse_template.scanning(csw)
+
+
+def get_project_template_dirs():
+    """ returns the template directories of an already configured django
+        project: settings.TEMPLATE_DIRS and the template directories
+        of the installed apps.
+    """
+    from django.template.loaders.app_directories import app_template_dirs
+    template_dirs = list(settings.TEMPLATE_DIRS)
+    for template_dir in app_template_dirs:
+        if template_dir not in template_dirs:
+            template_dirs.append(template_dir)
+    return template_dirs
+
+
+def _get_project_scan_loaders(loaders):
+    """ returns the loaders to use when scanning the templates of a
+        project. cached loaders are replaced by the loaders that they wrap,
+        as templates compiled before (or during) the scan must not be
+        re-used, and the nop loader is added last.
+    """
+    from django.template.loaders import cached
+    from .loaders import nop
+    ret = []
+    for loader in loaders:
+        if isinstance(loader, cached.Loader):
+            ret.extend(_get_project_scan_loaders(loader.loaders))
+        elif not isinstance(loader, nop.Loader):
+            ret.append(loader)
+    return ret
+
+
+_project_scan_lock = threading.Lock()
+_project_scan_state = {'count': 0, 'restore': None}
+
+
+@contextlib.contextmanager
+def project_scan_environment():
+    """ prepares an already configured django project, without calling
+        settings.configure, for scanning its templates within the with block.
+        the project's template loaders and settings are restored afterwards.
+        as they are process wide, concurrent (e.g. threaded) scans share
+        the environment, which is prepared by the first scan and restored
+        when the last scan is done.
+    """
+    from django.test.utils import override_settings
+    from .loaders import nop
+    with _project_scan_lock:
+        if not _project_scan_state['count']:
+            loaders = parse_template.get_template_source_loaders()
+            django.template.loader.template_source_loaders = tuple(
+                _get_project_scan_loaders(loaders) + [nop.Loader()])
+            settings_override = override_settings(TEMPLATE_DEBUG=True)
+            settings_override.enable()
+            _project_scan_state['restore'] = loaders, settings_override
+        _project_scan_state['count'] += 1
+    try:
+        yield
+    finally:
+        with _project_scan_lock:
+            _project_scan_state['count'] -= 1
+            if not _project_scan_state['count']:
+                loaders, settings_override = _project_scan_state['restore']
+                _project_scan_state['restore'] = None
+                settings_override.disable()
+                django.template.loader.template_source_loaders = loaders
+
+
+def scan_project(**kwargs):
+    """ returns the results of scanning the templates of an already
+        configured django project, see walk_templates for the kwargs.
+    """
+    with project_scan_environment():
+        return walk_templates(get_project_template_dirs(), **kwargs)
+
+
+def _load_template(template_name):
+    """ returns a (template, skip reason) tuple, see get_template_wrapped.
+        the skip reason is the stats counter of why the template could not
+        be loaded or None.
+    """
+    try:
+        return loader.get_template(template_name), None
+    except django.template.base.TemplateSyntaxError as e:
+        skip_reason = _stats.TEMPLATES_SKIPPED_SYNTAX_ERROR
+        msg = "skipping %s %s" % (template_name, repr(e))
+    except UnicodeDecodeError as e:
+        skip_reason = _stats.TEMPLATES_SKIPPED_DECODE_ERROR
+        msg = "skipping %s %s" % (template_name, repr(e))
+    warnings.warn(msg)
+    return None, skip_reason
 
 
 def get_template_wrapped(template_name):
@@ -41,12 +149,7 @@ def get_template_wrapped(template_name):
         if the template can be loaded.
         otherwise returns None.
     """
-    try:
-        return loader.get_template(template_name)
-    except (django.template.base.TemplateSyntaxError, UnicodeDecodeError) as e:
-        msg = "skipping %s %s" % (template_name, repr(e))
-        warnings.warn(msg)
-    return None
+    return _load_template(template_name)[0]
 
 
 def is_vuln_in_parent(result, template_name):
@@ -64,18 +167,12 @@ def is_vuln_already_in_include(result, input_results):
     """ returns true if the given result is already present in the
         'included' file.
     """
-    if not hasattr(result, 'source_node'):
-        return False
-    if not (result.source_node and result._var_node.source):
-        return False
-    lookup_name = result._var_node.source[0].loadname
-    if lookup_name not in input_results:
+    lookup_name = result.get_include_name()
+    if lookup_name is None or lookup_name not in input_results:
         return False
-    result_v_info = parse_template._get_var_node_source_info(result._var_node)
+    result_v_info = result.get_var_node_source_info()
     for _res in input_results[lookup_name]:
-        _rv_info = parse_template._get_var_node_source_info(
-            _res._var_node)
-        if _rv_info == result_v_info:
+        if _res.get_var_node_source_info() == result_v_info:
             return True
     return False
 
@@ -108,39 +205,236 @@ def uniquify_results(input_results):
     return ret
 
 
-def walk_templates(template_dirs):
-    templates = (os.path.relpath(os.path.join(root, _file), template_dir)
-                 for template_dir in template_dirs
-                 for root, dirs, files in os.walk(smart_text(template_dir))
-                 for _file in files)
+def get_template_names(template_dirs):
+    """ returns a generator of the names of the templates found
+        in template_dirs.
+    """
+    return (os.path.relpath(os.path.join(root, _file), template_dir)
+            for template_dir in template_dirs
+            for root, dirs, files in os.walk(smart_text(template_dir))
+            for _file in files)
+
+
+def _scan_template(templ, csw, skip_rendered_includes=False):
+    """ scans the template templ - adding its results to csw.
+        returns the stats counter of why the template could not be
+        (fully) scanned or None.
+    """
+    template, skip_reason = _load_template(templ)
+    context = parse_template.get_default_context()
+    if skip_rendered_includes:
+        context.rendered_includes = set()
+    if template is None:
+        return skip_reason
+    _source, _origin_fname = parse_template.get_template_source(templ)
+    for method in [parse_template.get_non_js_escaped_results_for_template,
+                   parse_template.get_non_quoted_attr_vars_for_template]:
+        try:
+            for result in method(template, source=_source,
+                                 origin_fname=_origin_fname):
+                csw.handle_callback(result)
+        except ValueError as e:
+            warnings.warn("could not call %s, %s" % (
+                method.__name__, e))
+    try:
+        with csw.profile('render', templ):
+            template.render(context)
+    except (django.template.base.TemplateSyntaxError,
+            django.template.base.TemplateDoesNotExist,
+            TypeError) as e:
+        msg = "skipping %s %s" % (templ, repr(e))
+        warnings.warn(msg)
+        return _stats.TEMPLATES_RENDER_ERROR
+    return None
+
+
+ScannedTemplate = collections.namedtuple(
+    'ScannedTemplate', ['name', 'results', 'duration',
+                        'snippet_cache_counts', 'skip_reason', 'pid', 'rss'])
+
+
+def _scan_template_timed(templ, profile_hooks=None,
+                         skip_rendered_includes=False):
+    """ scans the template templ and returns a ScannedTemplate, which
+        includes the pid and resident set size of the scanning process.
+    """
+    snippet_cache = parse_template.snippet_cache
+    hits, misses = snippet_cache.get_thread_counts()
+    start = time.time()
+    csw = parse_template.CompileStringWrapper(profile_hooks=profile_hooks)
+    with patched(csw), csw.profile('scan', templ):
+        skip_reason = _scan_template(templ, csw, skip_rendered_includes)
+    return ScannedTemplate(
+        templ, csw.results, time.time() - start,
+        tuple(count - previous for count, previous in zip(
+            snippet_cache.get_thread_counts(), (hits, misses))),
+        skip_reason, os.getpid(), _metrics.get_rss())
+
+
+_worker_kwargs = {}
+
+
+def _init_scan_worker(kwargs):
+    _worker_kwargs.update(kwargs)
+
+
+def _scan_template_in_worker(templ):
+    """ _scan_template_timed for a worker process, the results are
+        returned as SerializedFindings so that they can be pickled.
+    """
+    scanned = _scan_template_timed(templ, **_worker_kwargs)
+    return scanned._replace(results=[
+        parse_template.SerializedFinding(
+            **parse_template.serialize_finding(result))
+        for result in scanned.results])
+
+
+def _scan_templates_in_parallel(templates, jobs, use_threads=False,
+                                **kwargs):
+    """ returns a generator of the ScannedTemplates of scanning
+        the templates, in the given order, with jobs worker processes.
+        the worker processes are forked so that they share the django
+        configuration of this process.
+        use_threads: when True the templates are scanned with jobs threads
+        instead, e.g. for template trees on slow file systems.
+    """
+    if use_threads:
+        pool = multiprocessing.pool.ThreadPool(jobs)
+        scan = functools.partial(_scan_template_timed, **kwargs)
+    else:
+        pool = multiprocessing.Pool(jobs, initializer=_init_scan_worker,
+                                    initargs=(kwargs, ))
+        scan = _scan_template_in_worker
+    try:
+        for scanned in pool.imap_unordered(scan, templates):
+            yield scanned
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _copy_results(results, filename, new_filename):
+    """ returns a copy of the results of the template file filename for
+        the template file new_filename, which has the same content.
+    """
+    return [parse_template.relocate_finding(result, filename, new_filename)
+            for result in results]
+
+
+def walk_templates(template_dirs, shard=None, uniquify=True, baseline=None,
+                   profile_hooks=None, skip_rendered_includes=False,
+                   prefilter=True, dedup_content=True, stats=None, jobs=1,
+                   timings=None, metrics=None, use_threads=False):
+    """ returns the results of scanning the templates in template_dirs.
+        shard: an optional (index, count) tuple to only scan
+        the templates of the given shard.
+        uniquify: when False the results are returned without
+        calling uniquify_results, e.g. so that they can be merged
+        with the results of other shards first.
+        baseline: an optional set of finding fingerprints, see
+        baseline.load_baseline, whose findings are left out of the
+        uniquified results.
+        profile_hooks: optional profile hooks for the CompileStringWrapper
+        of each template, see CompileStringWrapper.add_profile_hook.
+        skip_rendered_includes: when True an include node is not rendered
+        again (e.g. by another branch of an {% if %} tag) when it has
+        already been rendered from the same source node and autoescape
+        context - as its findings have already been recorded.
+        prefilter: when True templates that prefilter.can_have_findings
+        finds cannot have any findings are not scanned.
+        dedup_content: when True templates are only scanned once per
+        TemplateIndex.get_content_key - the results are copied to the
+        other templates with the same content.
+        stats: an optional stats.ScanStats instance to update.
+        jobs: the number of worker processes to scan the templates with,
+        the most expensive templates are scanned first, see
+        timings.order_longest_first.
+        use_threads: when True the jobs are threads rather than processes.
+        timings: an optional dict of template name to scan duration,
+        see timings.load_timings, which is updated with the scan duration
+        of each scanned template.
+        metrics: an optional metrics.MetricsWriter that is updated with
+        stats as the scan progresses.
+    """
+    if stats is None:
+        stats = _stats.ScanStats()
+    if timings is None:
+        timings = {}
+    template_index = _template_index.TemplateIndex()
+    templates = get_template_names(template_dirs)
+    if shard is not None:
+        templates = _shard.get_shard_templates(
+            templates, *shard, template_index=template_index)
     results = {}
+    scanned_content = {}
+    duplicates = []
+    to_scan = []
     for templ in templates:
-        csw = parse_template.CompileStringWrapper()
-        patch(csw)
-        template = get_template_wrapped(templ)
-        context = parse_template.get_default_context()
-        if template is None:
+        stats.increment(_stats.TEMPLATES_DISCOVERED)
+        if metrics is not None:
+            metrics.update(stats)
+        if prefilter and not _prefilter.can_have_findings(
+                template_index, templ):
+            stats.increment(_stats.TEMPLATES_SKIPPED_PREFILTER)
             continue
-        _source, _origin_fname = parse_template.get_template_source(templ)
-        for method in [parse_template.get_non_js_escaped_results_for_template,
-                       parse_template.get_non_quoted_attr_vars_for_template]:
-            try:
-                for result in method(template, source=_source,
-                                     origin_fname=_origin_fname):
-                    csw.handle_callback(result)
-            except ValueError as e:
-                warnings.warn("could not call %s, %s" % (
-                    method.__name__, e))
-        try:
-            template.render(context)
-        except (django.template.base.TemplateSyntaxError,
-                django.template.base.TemplateDoesNotExist,
-                TypeError) as e:
-            msg = "skipping %s %s" % (templ, repr(e))
-            warnings.warn(msg)
-        if csw.results:
-            results[templ] = csw.results
-    return uniquify_results(results)
+        if dedup_content:
+            content_key = template_index.get_content_key(templ)
+            if content_key in scanned_content:
+                stats.increment(_stats.TEMPLATES_SKIPPED_DUPLICATE)
+                duplicates.append((scanned_content[content_key], templ))
+                continue
+            if content_key is not None:
+                scanned_content[content_key] = templ
+        to_scan.append(templ)
+    scan_kwargs = {'profile_hooks': profile_hooks,
+                   'skip_rendered_includes': skip_rendered_includes}
+    if jobs > 1:
+        scanned = _scan_templates_in_parallel(
+            _timings.order_longest_first(to_scan, template_index, timings),
+            jobs, use_threads, **scan_kwargs)
+    else:
+        scanned = (_scan_template_timed(templ, **scan_kwargs)
+                   for templ in to_scan)
+    snippet_cache_hits = snippet_cache_misses = 0
+    scanned_results = {}
+    for scanned_template in scanned:
+        timings[scanned_template.name] = scanned_template.duration
+        snippet_cache_hits += scanned_template.snippet_cache_counts[0]
+        snippet_cache_misses += scanned_template.snippet_cache_counts[1]
+        stats.set_snippet_cache_counts(snippet_cache_hits,
+                                       snippet_cache_misses)
+        if scanned_template.pid != os.getpid():
+            stats.set_worker_rss(scanned_template.pid, scanned_template.rss)
+        if scanned_template.skip_reason not in _stats.TEMPLATES_NOT_LOADED:
+            stats.increment(_stats.TEMPLATES_SCANNED)
+        if scanned_template.skip_reason is not None:
+            stats.increment(scanned_template.skip_reason)
+        stats.add_findings(scanned_template.results)
+        if scanned_template.results:
+            scanned_results[scanned_template.name] = scanned_template.results
+        if metrics is not None:
+            metrics.update(stats)
+    # parallel scans finish in any order, the results are added in the
+    # order of to_scan so that the output is the same for every scan.
+    for templ in to_scan:
+        if templ in scanned_results:
+            results[templ] = scanned_results[templ]
+    for scanned_templ, templ in duplicates:
+        if scanned_templ in results:
+            results[templ] = _copy_results(
+                results[scanned_templ],
+                template_index.get_info(scanned_templ).origin_fname,
+                template_index.get_info(templ).origin_fname)
+            stats.add_findings(results[templ])
+    if metrics is not None:
+        metrics.update(stats, force=True)
+    if not uniquify:
+        return results
+    results = uniquify_results(results)
+    if baseline:
+        results = _baseline.remove_baseline_results(results, baseline)
+    return results
 
 
 def get_non_quoted_content(content):